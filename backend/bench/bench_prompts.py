@@ -0,0 +1,201 @@
+"""
+Benchmark des appels Ollama : anciens prompts (date en tête du message user,
+format "json" libre) vs prompts actuels (préfixe system stable, schémas JSON,
+num_predict / num_ctx / keep_alive).
+
+Nécessite un serveur Ollama avec le modèle MODEL_NAME. Depuis backend/ :
+    python -m bench.bench_prompts --rounds 3
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+
+import ollama
+
+from mcp.model import (
+    FLIGHT_NUM_PREDICT,
+    FLIGHT_SCHEMA,
+    FLIGHT_SYSTEM_PROMPT,
+    HOTEL_NUM_PREDICT,
+    HOTEL_SCHEMA,
+    HOTEL_SYSTEM_PROMPT,
+    MODEL_NAME,
+    ROUTER_NUM_PREDICT,
+    ROUTER_SCHEMA,
+    ROUTER_SYSTEM_PROMPT,
+    call_model,
+    get_current_date,
+)
+
+# (message, appels dans l'ordre d'un vrai tour) : le routeur, puis l'extracteur du type de demande.
+# L'alternance routeur / extracteur sur un seul slot Ollama évince le préfixe mis en cache :
+# c'est le cas mesuré par défaut (--grouped enchaîne les appels d'un même type, cas optimiste).
+TURNS = [
+    ("vol TLS CDG 2026-02-10", ["router", "flight"]),
+    ("je cherche un aller-retour Toulouse Lisbonne du 2026-03-02 au 2026-03-09", ["router", "flight"]),
+    ("hotel Paris 2026-02-10 2026-02-12", ["router", "hotel"]),
+    ("je réserve le vol 2 au nom de Dupont Jean", ["router"]),
+    ("que visiter à Madrid ?", ["router"]),
+]
+MESSAGES = [message for message, _ in TURNS]
+
+
+# ---------------------------
+# ANCIENS PROMPTS (avant restructuration)
+# ---------------------------
+
+def _legacy_router_prompt(message: str) -> str:
+    return (
+        f"{get_current_date()}\n"
+        "Analyse le message de l'utilisateur pour déterminer s'il veut (RECHERCHER un vol ou RÉSERVER un vol) ou (RECHERCHER un hotel) ou (avoir des suggestions ou avoir une conversation).\n\n"
+        "CONSIGNES JSON STRICTES :\n"
+        "1) Ajoute une clé 'intent' qui vaut soit 'search' soit 'book' soit 'advice' soit 'hotel'.\n"
+        "2) Si intent == 'search' : réponds en JSON à plat avec UNIQUEMENT ces clés :\n"
+        "   intent, originLocationCode, destinationLocationCode, departureDate, adults.\n"
+        "   - originLocationCode / destinationLocationCode : codes IATA (3 lettres majuscules)\n"
+        "   - departureDate : YYYY-MM-DD\n"
+        "   - adults : nombre (1 par défaut)\n"
+        "3) Si intent == 'book' : réponds en JSON à plat avec UNIQUEMENT ces clés :\n"
+        "   intent, flight_index, nom, prenom\n"
+        "   - flight_index : numéro du vol que l'utilisateur veut réserver (1 par défaut)\n"
+        "   - nom / prenom : si l'utilisateur les donne dans la phrase, sinon null\n"
+        "4) si intent == 'advice' : réponds en JSON à plat avec UNIQUEMENT la clé: intent\n"
+        "5) si intent == 'hotel' : réponds en JSON à plat avec UNIQUEMENT la clés : intent\n"
+        "6) Important, Tu réponds UNIQUEMENT en format JSON valide.\n"
+        f"Phrase : {message}"
+    )
+
+
+def _legacy_flight_prompt(message: str) -> str:
+    return (
+        "Tu extrais des informations de vol.\n"
+        "Réponds UNIQUEMENT en JSON à plat avec ces clés :\n"
+        "originLocationCode, destinationLocationCode, departureDate, adults.\n"
+        "origin/destination = codes IATA (ex: TLS, CDG).\n"
+        "departureDate = YYYY-MM-DD.\n"
+        "adults = nombre (1 par défaut).\n\n"
+        f"Phrase : {message}"
+    )
+
+
+def _legacy_hotel_prompt(message: str) -> str:
+    return (
+        "Tu extrais des informations d’hôtel.\n"
+        "Réponds UNIQUEMENT en JSON à plat avec ces clés :\n"
+        "city_name, checkin, checkout, adults, rooms.\n"
+        "Dates = YYYY-MM-DD.\n"
+        "ATTENTION : si checkin/checkout ne sont pas présents dans la phrase, mets null.\n"
+        "adults = 2 par défaut, rooms = 1 par défaut.\n\n"
+        f"Phrase : {message}"
+    )
+
+
+def legacy_call(kind: str, message: str) -> dict:
+    if kind == "router":
+        system, prompt = "Tu es un assistant de voyage. Tu réponds UNIQUEMENT en JSON valide.", _legacy_router_prompt(message)
+    elif kind == "flight":
+        system, prompt = "Tu réponds uniquement en JSON valide.", _legacy_flight_prompt(message)
+    else:
+        system, prompt = "Tu réponds uniquement en JSON valide.", _legacy_hotel_prompt(message)
+
+    return ollama.chat(
+        model=MODEL_NAME,
+        format="json",
+        messages=[{"role": "system", "content": system}, {"role": "user", "content": prompt}],
+    )
+
+
+# ---------------------------
+# PROMPTS ACTUELS
+# ---------------------------
+
+_CURRENT = {
+    "router": (ROUTER_SYSTEM_PROMPT, ROUTER_SCHEMA, ROUTER_NUM_PREDICT),
+    "flight": (FLIGHT_SYSTEM_PROMPT, FLIGHT_SCHEMA, FLIGHT_NUM_PREDICT),
+    "hotel": (HOTEL_SYSTEM_PROMPT, HOTEL_SCHEMA, HOTEL_NUM_PREDICT),
+}
+
+
+def current_call(kind: str, message: str) -> dict:
+    # Même construction que mcp.model._extract, mais on garde la réponse brute (compteurs Ollama)
+    system, schema, num_predict = _CURRENT[kind]
+    return call_model(
+        [
+            {"role": "system", "content": system},
+            {"role": "user", "content": f"{get_current_date()}\nPhrase : {message}"},
+        ],
+        format=schema,
+        options={"num_predict": num_predict, "temperature": 0},
+    )
+
+
+# ---------------------------
+# MESURE
+# ---------------------------
+
+def _measure(call, kind: str, message: str) -> dict:
+    start = time.perf_counter()
+    r = call(kind, message)
+    wall = time.perf_counter() - start
+    return {
+        "prompt_tokens": r.get("prompt_eval_count") or 0,  # tokens réellement évalués (hors cache)
+        "gen_tokens": r.get("eval_count") or 0,
+        "prompt_ms": (r.get("prompt_eval_duration") or 0) / 1e6,
+        "gen_ms": (r.get("eval_duration") or 0) / 1e6,
+        "load_ms": (r.get("load_duration") or 0) / 1e6,
+        "wall_ms": wall * 1000,
+    }
+
+
+def run(variant: str, call, rounds: int, grouped: bool = False) -> list:
+    # Appel de chauffe : exclut le chargement du modèle (num_ctx différent entre les variantes)
+    call("router", MESSAGES[0])
+
+    calls = [(kind, message) for message, kinds in TURNS for kind in kinds]
+    if grouped:
+        calls.sort(key=lambda c: c[0])
+
+    samples = []
+    for _ in range(rounds):
+        for kind, message in calls:
+            samples.append({"variant": variant, "kind": kind, **_measure(call, kind, message)})
+    return samples
+
+
+def _report(samples: list) -> None:
+    print(f"{'variante':<9} {'appel':<7} {'n':>3} {'tok. prompt':>11} {'tok. générés':>12} "
+          f"{'prompt ms':>9} {'génér. ms':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    groups = {}
+    for s in samples:
+        groups.setdefault((s["variant"], s["kind"]), []).append(s)
+
+    for (variant, kind), group in groups.items():
+        walls = sorted(s["wall_ms"] for s in group)
+        p95 = walls[min(int(len(walls) * 0.95), len(walls) - 1)]
+        print(
+            f"{variant:<9} {kind:<7} {len(group):>3} "
+            f"{statistics.mean(s['prompt_tokens'] for s in group):>11.1f} "
+            f"{statistics.mean(s['gen_tokens'] for s in group):>12.1f} "
+            f"{statistics.mean(s['prompt_ms'] for s in group):>9.1f} "
+            f"{statistics.mean(s['gen_ms'] for s in group):>9.1f} "
+            f"{statistics.median(walls):>8.1f} {p95:>8.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark prompts Ollama (avant / après)")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--grouped", action="store_true",
+                        help="appels d'un même type à la suite (réutilisation du préfixe optimiste)")
+    args = parser.parse_args()
+
+    samples = run("avant", legacy_call, args.rounds, args.grouped)
+    samples += run("après", current_call, args.rounds, args.grouped)
+    print("ordre :", "groupé par type d'appel" if args.grouped else "tours réels (routeur puis extracteur)")
+    _report(samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark de la sérialisation des réponses /chat par type de tour :
+temps d'encodage (chemin FastAPI par défaut vs FastJSONResponse) et octets
+envoyés (brut, gzip, br). Les textes de réponse sont ceux du controller.
+
+Aucune dépendance externe à lancer (données Amadeus synthétiques). Depuis backend/ :
+    python -m bench.bench_serialization --repeat 2000
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from mcp.controller import (
+    _flights_to_text,
+    _hotels_to_text,
+    _room_details_to_text,
+    combine_legs,
+    format_flight_data,
+    format_hotel_data,
+)
+from bench.fixtures import raw_flights, raw_hotels
+from responses import FastJSONResponse, orjson
+
+try:
+    import brotli
+except ImportError:  # dépendance optionnelle
+    brotli = None
+
+FLIGHT_FOLLOWUP = "Pour réserver, indique le numéro du vol (ex : « je réserve le vol 1 »)."
+ROOM_FOLLOWUP = "J'ai trouvé des détails sur les chambres (lits, conditions). Voulez-vous les voir ? (oui/non)"
+ADVICE_ANSWER = (
+    "Lisbonne se découvre très bien en 3 jours ! 🌞\n\n"
+    "1. Alfama : perds-toi dans les ruelles jusqu'au belvédère de Santa Luzia au coucher du soleil.\n"
+    "2. Belém : le monastère des Hiéronymites, la tour de Belém, et un pastel de nata encore tiède.\n"
+    "3. LX Factory : ancienne usine transformée en quartier de boutiques, librairie et restaurants.\n"
+    "4. Une soirée fado dans un petit restaurant de la Mouraria.\n\n"
+    "Pense à prendre la carte Viva Viagem pour le tram 28 et le métro."
+)
+
+
+def _flights_turn(route: str, flights: list) -> dict:
+    return {"session_id": "s", "answer": f"✈️ Vols trouvés ({route}) :\n\n{_flights_to_text(flights)}",
+            "flights": flights, "followup": FLIGHT_FOLLOWUP}
+
+
+def turn_payloads() -> dict:
+    hotels = format_hotel_data(raw_hotels())
+    room_details = [{"name": h["name"], "roomDetails": h["roomDetails"]} for h in hotels[:5]]
+    legs = [
+        format_flight_data(raw_flights("TLS", "LIS", "2026-03-02")),
+        format_flight_data(raw_flights("LIS", "MAD", "2026-03-05")),
+    ]
+    hotel_answer = (
+        f"🏨 Hôtels trouvés à Paris du 2026-02-10 au 2026-02-12 :\n\n{_hotels_to_text(hotels)}\n\n{ROOM_FOLLOWUP}"
+    )
+    return {
+        "vol aller simple": _flights_turn("TLS -> CDG", format_flight_data(raw_flights("TLS", "CDG", "2026-02-10"))),
+        "aller-retour": _flights_turn(
+            "TLS -> LIS, aller-retour", format_flight_data(raw_flights("TLS", "LIS", "2026-03-02", "2026-03-09"))
+        ),
+        "multi-destinations": _flights_turn("TLS -> LIS -> MAD", combine_legs(legs)),
+        "hôtels": {"session_id": "s", "answer": hotel_answer, "hotels": hotels, "followup": ROOM_FOLLOWUP},
+        "détails chambre": {"session_id": "s", "answer": _room_details_to_text(room_details),
+                            "roomDetails": room_details},
+        "conseil": {"session_id": "s", "answer": ADVICE_ANSWER, "flights": [], "hotels": []},
+    }
+
+
+# ---------------------------
+# MESURE
+# ---------------------------
+
+def _time_us(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1e6 / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark sérialisation / compression des réponses /chat")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"encodeur rapide : {'orjson' if orjson is not None else 'json (orjson non installé)'}"
+          f" — brotli : {'oui' if brotli is not None else 'non installé'}")
+    print(f"{'tour':<20} {'défaut µs':>10} {'rapide µs':>10} {'octets':>7} {'gzip':>6} {'br':>6}")
+
+    for name, payload in turn_payloads().items():
+        # Chemin FastAPI par défaut : jsonable_encoder + json.dumps
+        default_us = _time_us(lambda: JSONResponse(jsonable_encoder(payload)), args.repeat)
+        fast_us = _time_us(lambda: FastJSONResponse(payload), args.repeat)
+
+        body = FastJSONResponse(payload).body
+        gz = len(gzip.compress(body, compresslevel=9))  # niveau utilisé par GZipMiddleware
+        br = len(brotli.compress(body, quality=4)) if brotli is not None else None
+
+        print(f"{name:<20} {default_us:>10.1f} {fast_us:>10.1f} "
+              f"{len(body):>7} {gz:>6} {br if br is not None else '-':>6}")
+
+
+if __name__ == "__main__":
+    main()
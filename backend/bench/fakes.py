@@ -0,0 +1,240 @@
+"""
+Faux Ollama / Amadeus / Google Sheets pour le load-test en process.
+
+Chaque faux service simule un temps de service (avec dispersion log-normale
+et une petite queue lente) ; le faux Ollama a un nombre limité de slots
+parallèles comme un vrai serveur (OLLAMA_NUM_PARALLEL), c'est là que les
+requêtes font la queue quand la charge monte.
+"""
+from __future__ import annotations
+
+import json
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+import requests
+
+import mcp.controller
+import mcp.model
+import mcp.provider
+from bench.fixtures import raw_flights, raw_hotel_list, raw_hotels
+from mcp.model import BOOKING_SCHEMA, FLIGHT_SCHEMA, HOTEL_SCHEMA, ROUTER_SCHEMA
+from mcp.stages import stage
+
+IATA_RE = re.compile(r"\b[A-Z]{3}\b")
+DATE_RE = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+INDEX_RE = re.compile(r"\b(\d{1,2})\b")
+CITY_RE = re.compile(r"h[oô]tel\s+(?:à\s+)?([A-ZÀ-Ü][\w-]+)", re.IGNORECASE)
+
+
+def _jitter(ms: float, rng: random.Random, slow_ratio: float = 0.03) -> float:
+    """Temps de service en secondes : log-normal autour de ms, avec quelques appels 5x plus lents."""
+    t = ms * rng.lognormvariate(0, 0.25)
+    if rng.random() < slow_ratio:
+        t *= 5
+    return t / 1000
+
+
+# ---------------------------
+# OLLAMA
+# ---------------------------
+
+class FakeOllama:
+    """Se substitue au module `ollama` importé par mcp.model (chat + Client(timeout=...))."""
+
+    # Durée relative de chaque type d'appel (le conseil génère un long texte)
+    COST = {"router": 1.0, "flight": 0.8, "hotel": 0.6, "booking": 0.5, "advice": 3.0}
+
+    def __init__(self, service_ms: float = 600, parallel: int = 1, seed: int = 0):
+        self.service_ms = service_ms
+        self._slots = threading.BoundedSemaphore(parallel)
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def Client(self, timeout: Optional[float] = None, **_kwargs) -> "_FakeOllamaClient":
+        return _FakeOllamaClient(self, timeout)
+
+    def chat(self, model: str = "", messages=None, format=None, options=None, keep_alive=None, **_kwargs) -> dict:
+        return self._chat(messages, format, None)
+
+    def _chat(self, messages, format, timeout: Optional[float]) -> dict:
+        kind = self._kind(format)
+        with self._rng_lock:
+            service = _jitter(self.service_ms * self.COST[kind], self._rng)
+
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=timeout if timeout is not None else -1):
+            raise TimeoutError("fake ollama : pas de slot libre à temps")
+        try:
+            if timeout is not None and time.monotonic() - start + service > timeout:
+                time.sleep(max(timeout - (time.monotonic() - start), 0))
+                raise TimeoutError("fake ollama : timeout")
+            time.sleep(service)
+        finally:
+            self._slots.release()
+
+        message = (messages or [{}])[-1].get("content", "")
+        phrase = message.split("Phrase : ", 1)[-1]
+        if kind == "advice":
+            content = "Voici 3 idées : une balade dans la vieille ville 🏛️, un marché local, un coucher de soleil au port."
+        else:
+            content = json.dumps(self._answer(kind, phrase))
+        return {"message": {"role": "assistant", "content": content}, "eval_count": 40}
+
+    @staticmethod
+    def _kind(format) -> str:
+        if format is ROUTER_SCHEMA:
+            return "router"
+        if format is FLIGHT_SCHEMA:
+            return "flight"
+        if format is HOTEL_SCHEMA:
+            return "hotel"
+        if format is BOOKING_SCHEMA:
+            return "booking"
+        return "advice"
+
+    @staticmethod
+    def _answer(kind: str, phrase: str) -> dict:
+        lower = phrase.lower()
+        codes = IATA_RE.findall(phrase)
+        # "TLS LIS ... puis LIS MAD" : une ville répétée enchaîne deux étapes (TLS -> LIS -> MAD)
+        route = [code for i, code in enumerate(codes) if i == 0 or code != codes[i - 1]]
+        dates = DATE_RE.findall(phrase)
+        index = INDEX_RE.findall(DATE_RE.sub("", phrase))
+        booking = {"flight_index": int(index[0]) if index else 1, "nom": None, "prenom": None}
+
+        flight = {
+            "originLocationCode": route[0] if len(route) > 1 else None,
+            "destinationLocationCode": route[1] if len(route) > 1 else None,
+            "departureDate": dates[0] if dates else None,
+            "returnDate": dates[1] if len(route) == 2 and len(dates) > 1 else None,
+            "legs": [
+                {"originLocationCode": a, "destinationLocationCode": b, "departureDate": d}
+                for a, b, d in zip(route, route[1:], dates)
+            ] if len(route) > 2 else None,
+            "adults": 1,
+        }
+
+        if kind == "flight":
+            return flight
+        if kind == "booking":
+            return booking
+        if kind == "hotel":
+            city = CITY_RE.search(phrase)
+            return {
+                "city_name": city.group(1) if city else None,
+                "checkin": dates[0] if dates else None,
+                "checkout": dates[1] if len(dates) > 1 else None,
+                "adults": 2,
+                "rooms": 1,
+            }
+
+        # router
+        if "hotel" in lower or "hôtel" in lower:
+            return {"intent": "hotel"}
+        if "réserv" in lower or "book" in lower:
+            return {"intent": "book", **booking}
+        if len(route) > 1:
+            return {"intent": "search", **flight}
+        return {"intent": "advice"}
+
+
+class _FakeOllamaClient:
+    def __init__(self, fake: FakeOllama, timeout: Optional[float]):
+        self._fake = fake
+        self._timeout = timeout
+
+    def chat(self, model: str = "", messages=None, format=None, options=None, keep_alive=None, **_kwargs) -> dict:
+        return self._fake._chat(messages, format, self._timeout)
+
+
+# ---------------------------
+# AMADEUS
+# ---------------------------
+
+class _FakeResponse:
+    def __init__(self, payload: dict):
+        self._payload = payload
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def json(self) -> dict:
+        return self._payload
+
+
+class FakeAmadeus:
+    """Se substitue au module `requests` importé par mcp.provider."""
+
+    Timeout = requests.Timeout
+    ConnectionError = requests.ConnectionError
+    HTTPError = requests.HTTPError
+    RequestException = requests.RequestException
+
+    def __init__(self, service_ms: float = 400, seed: int = 0):
+        self.service_ms = service_ms
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def _sleep(self, ms: float, timeout: Optional[float]) -> None:
+        with self._rng_lock:
+            t = _jitter(ms, self._rng)
+        if timeout is not None and t > timeout:
+            time.sleep(timeout)
+            raise requests.Timeout("fake amadeus : timeout")
+        time.sleep(t)
+
+    def post(self, url, data=None, headers=None, timeout=None, **_kwargs) -> _FakeResponse:
+        self._sleep(self.service_ms * 0.3, timeout)
+        return _FakeResponse({"access_token": "fake-token", "expires_in": 1799})
+
+    def get(self, url, headers=None, params=None, timeout=None, **_kwargs) -> _FakeResponse:
+        params = params or {}
+        if url == mcp.provider.FLIGHTS_URL:
+            self._sleep(self.service_ms, timeout)
+            return _FakeResponse({"data": raw_flights(
+                params["originLocationCode"], params["destinationLocationCode"],
+                params["departureDate"], params.get("returnDate"), n=int(params.get("max", 5)),
+            )})
+        if url == mcp.provider.CITY_SEARCH_URL:
+            self._sleep(self.service_ms * 0.3, timeout)
+            return _FakeResponse({"data": [{"iataCode": str(params.get("keyword", "PAR"))[:3].upper()}]})
+        if url == mcp.provider.HOTEL_LIST_URL:
+            self._sleep(self.service_ms * 0.5, timeout)
+            return _FakeResponse({"data": raw_hotel_list(params["cityCode"])})
+        if url == mcp.provider.HOTEL_OFFERS_URL:
+            ids = params["hotelIds"].split(",")
+            # hotel-offers : le temps de réponse grandit avec le nombre d'hôtels demandés
+            self._sleep(self.service_ms * 0.5 * len(ids), timeout)
+            return _FakeResponse({"data": raw_hotels(ids, params["checkInDate"], params["checkOutDate"])})
+        raise ValueError(f"URL inattendue : {url}")
+
+
+# ---------------------------
+# GOOGLE SHEETS
+# ---------------------------
+
+class FakeSheets:
+    def __init__(self, service_ms: float = 300, seed: int = 0):
+        self.service_ms = service_ms
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.rows = 0
+
+    def __call__(self, data: dict) -> None:
+        with self._rng_lock:
+            t = _jitter(self.service_ms, self._rng)
+        with stage("sheets"):
+            time.sleep(t)
+        self.rows += 1
+
+
+def install_fakes(llm_ms: float, llm_parallel: int, amadeus_ms: float, sheets_ms: float, seed: int = 0) -> None:
+    """Branche les faux services à la place des vrais (process courant uniquement)."""
+    mcp.model.ollama = FakeOllama(llm_ms, llm_parallel, seed)
+    mcp.provider.requests = FakeAmadeus(amadeus_ms, seed)
+    mcp.provider.CLIENT_ID = mcp.provider.CLIENT_SECRET = "fake"
+    mcp.controller.save_reservation_to_sheet = FakeSheets(sheets_ms, seed)
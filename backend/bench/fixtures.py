@@ -0,0 +1,69 @@
+"""
+Données Amadeus synthétiques (format brut de l'API) partagées par les benchmarks
+et les faux services du load-test.
+"""
+from __future__ import annotations
+
+from typing import List, Optional
+
+
+def raw_itinerary(origin: str, dest: str, day: str, stops: int) -> dict:
+    hops = [origin] + ["MAD", "BCN", "LIS"][:stops] + [dest]
+    return {
+        "duration": f"PT{2 + stops}H15M",
+        "segments": [
+            {
+                "departure": {"iataCode": a, "at": f"{day}T{8 + i:02d}:05:00"},
+                "arrival": {"iataCode": b, "at": f"{day}T{9 + i:02d}:20:00"},
+            }
+            for i, (a, b) in enumerate(zip(hops, hops[1:]))
+        ],
+    }
+
+
+def raw_flights(origin: str, dest: str, day: str, return_day: Optional[str] = None, n: int = 5) -> List[dict]:
+    flights = []
+    for i in range(n):
+        its = [raw_itinerary(origin, dest, day, i % 3)]
+        if return_day:
+            its.append(raw_itinerary(dest, origin, return_day, (i + 1) % 3))
+        flights.append({
+            "id": str(i + 1),
+            "validatingAirlineCodes": [["AF", "IB", "TP", "VY", "U2"][i]],
+            "itineraries": its,
+            "price": {"total": f"{89.5 + 23.1 * i:.2f}", "currency": "EUR"},
+        })
+    return flights
+
+
+def raw_hotel_list(city_code: str = "PAR", n: int = 10) -> List[dict]:
+    return [{"hotelId": f"HL{city_code}{i:03d}", "name": f"Hôtel Exemple {city_code} {i}"} for i in range(n)]
+
+
+def raw_hotels(hotel_ids: Optional[List[str]] = None, checkin: str = "2026-02-10",
+               checkout: str = "2026-02-12") -> List[dict]:
+    hotel_ids = hotel_ids or [h["hotelId"] for h in raw_hotel_list()]
+    return [
+        {
+            "hotel": {"hotelId": hotel_id, "name": f"Hôtel Exemple {hotel_id[2:5]} {i}", "cityCode": hotel_id[2:5]},
+            "offers": [
+                {
+                    "checkInDate": checkin,
+                    "checkOutDate": checkout,
+                    "price": {"total": f"{120 + 17 * i + j * 9}.00", "currency": "EUR"},
+                    "boardType": "ROOM_ONLY",
+                    "room": {
+                        "typeEstimated": {"category": "STANDARD_ROOM", "beds": 1 + j, "bedType": "DOUBLE"},
+                        "description": {"text": "Chambre double standard, salle de bain privative, "
+                                                "climatisation, télévision écran plat, Wi-Fi gratuit. " * 2},
+                    },
+                    "policies": {
+                        "paymentType": "deposit",
+                        "cancellation": {"deadline": "2026-02-08T23:59:00", "amount": "40.00"},
+                    },
+                }
+                for j in range(3)
+            ],
+        }
+        for i, hotel_id in enumerate(hotel_ids)
+    ]
@@ -0,0 +1,294 @@
+"""
+Load-test / capacity planning : rejoue des conversations complètes (plusieurs
+tours avec temps de réflexion) avec un nombre croissant d'utilisateurs virtuels,
+puis donne la latence (p50/p95/p99) par palier de concurrence et l'étape qui sature.
+
+Deux modes, depuis backend/ :
+    # en process : l'app FastAPI est appelée directement, Ollama/Amadeus/Sheets sont simulés
+    python -m bench.loadtest --users 1,2,4,8,16 --duration 30
+
+    # contre un serveur lancé à part (vrais services)
+    python -m bench.loadtest --url http://localhost:8000 --users 1,2,4
+
+Conversations : bench/transcripts.json (scriptées, {date} / {date_plus_2} / {date_plus_7}
+remplacés par des dates futures aléatoires ; "expect" = extrait attendu dans la réponse,
+les écarts sont comptés dans la colonne "inatt.") ou --recorded fichier.jsonl
+(une ligne par tour : {"session_id", "message", "ts"}, ts en secondes epoch ou ISO 8601).
+Le détail par étape vient de l'en-tête Server-Timing renvoyé par /chat.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+import httpx
+
+TRANSCRIPTS_PATH = os.path.join(os.path.dirname(__file__), "transcripts.json")
+MAX_RECORDED_THINK_S = 60.0
+TIMEOUT_ANSWER_PREFIX = "⏱️"
+
+# Étape "file" : temps vu par le client mais pas par le handler (attente d'un thread, réseau)
+QUEUE_STAGE = "file"
+OTHER_STAGE = "autre"
+
+
+# ---------------------------
+# CONVERSATIONS
+# ---------------------------
+
+def load_transcripts(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_recorded(path: str) -> List[dict]:
+    """Regroupe un journal de tours par session ; le temps de réflexion est l'écart entre deux tours."""
+    by_session: Dict[str, List[dict]] = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                by_session[item["session_id"]].append(item)
+
+    def _ts(item: dict) -> float:
+        ts = item.get("ts", 0)
+        return datetime.fromisoformat(ts).timestamp() if isinstance(ts, str) else float(ts)
+
+    conversations = []
+    for session_id, turns in by_session.items():
+        turns.sort(key=_ts)
+        conversations.append({
+            "name": f"enregistrée {session_id[:8]}",
+            "weight": 1,
+            "turns": [
+                {
+                    "message": t["message"],
+                    "think_s": min(_ts(nxt) - _ts(t), MAX_RECORDED_THINK_S) if nxt else 0,
+                }
+                for t, nxt in zip(turns, turns[1:] + [None])
+            ],
+        })
+    return conversations
+
+
+def _fill(message: str, rng: random.Random) -> str:
+    start = date.today() + timedelta(days=rng.randint(10, 90))
+    return message.format(
+        date=start.isoformat(),
+        date_plus_2=(start + timedelta(days=2)).isoformat(),
+        date_plus_7=(start + timedelta(days=7)).isoformat(),
+    )
+
+
+# ---------------------------
+# EXÉCUTION
+# ---------------------------
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """"llm;dur=412.3, amadeus;dur=88.0" -> {"llm": 0.4123, "amadeus": 0.088} (secondes)."""
+    timings = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                timings[name] = float(value) / 1000
+    return timings
+
+
+async def _virtual_user(client: httpx.AsyncClient, conversations: List[dict], stop_at: float,
+                        think_scale: float, rng: random.Random, results: List[dict]) -> None:
+    weights = [c.get("weight", 1) for c in conversations]
+    loop = asyncio.get_running_loop()
+
+    while loop.time() < stop_at:
+        conversation = rng.choices(conversations, weights=weights)[0]
+        session_id = f"loadtest-{uuid.uuid4()}"
+        for n, turn in enumerate(conversation["turns"]):
+            if loop.time() >= stop_at:
+                return
+
+            start = time.perf_counter()
+            try:
+                r = await client.post("/chat", json={"message": _fill(turn["message"], rng), "session_id": session_id})
+                elapsed = time.perf_counter() - start
+                answer = r.json().get("answer", "") if r.status_code == 200 else ""
+                results.append({
+                    "conversation": conversation["name"],
+                    "turn": n,
+                    "latency": elapsed,
+                    "error": r.status_code != 200 or answer.startswith("Erreur"),
+                    "degraded": answer.startswith(TIMEOUT_ANSWER_PREFIX),
+                    "unexpected": r.status_code == 200 and bool(turn.get("expect")) and turn["expect"] not in answer,
+                    "stages": parse_server_timing(r.headers.get("server-timing")),
+                })
+            except httpx.HTTPError:
+                results.append({
+                    "conversation": conversation["name"], "turn": n, "latency": time.perf_counter() - start,
+                    "error": True, "degraded": False, "unexpected": False, "stages": {},
+                })
+
+            await asyncio.sleep(turn.get("think_s", 0) * think_scale * rng.uniform(0.5, 1.5))
+
+
+async def run_level(client: httpx.AsyncClient, conversations: List[dict], users: int, duration: float,
+                    think_scale: float, seed: int) -> List[dict]:
+    results: List[dict] = []
+    stop_at = asyncio.get_running_loop().time() + duration
+    await asyncio.gather(*(
+        _virtual_user(client, conversations, stop_at, think_scale, random.Random(seed * 1000 + i), results)
+        for i in range(users)
+    ))
+    return results
+
+
+# ---------------------------
+# RAPPORT
+# ---------------------------
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def summarize(users: int, duration: float, results: List[dict]) -> dict:
+    latencies = [r["latency"] for r in results]
+    stage_totals: Dict[str, float] = defaultdict(float)
+    for r in results:
+        stages = {k: v for k, v in r["stages"].items() if k != "total"}
+        server_total = r["stages"].get("total")
+        for name, elapsed in stages.items():
+            stage_totals[name] += elapsed
+        if server_total is not None:
+            stage_totals[OTHER_STAGE] += max(server_total - sum(stages.values()), 0.0)
+            stage_totals[QUEUE_STAGE] += max(r["latency"] - server_total, 0.0)
+
+    n = len(results) or 1
+    return {
+        "users": users,
+        "turns": len(results),
+        "throughput": len(results) / duration,
+        "p50": _percentile(latencies, 50),
+        "p95": _percentile(latencies, 95),
+        "p99": _percentile(latencies, 99),
+        "mean": statistics.mean(latencies) if latencies else 0.0,
+        "errors": sum(r["error"] for r in results),
+        "degraded": sum(r["degraded"] for r in results),
+        "unexpected": sum(r["unexpected"] for r in results),
+        # temps moyen par tour passé dans chaque étape (cumulé si étapes parallèles)
+        "stages": {name: total / n for name, total in stage_totals.items()},
+    }
+
+
+def saturating_stage(levels: List[dict]) -> Optional[str]:
+    """L'étape dont le temps moyen par tour a le plus augmenté entre le premier et le dernier palier."""
+    if len(levels) < 2:
+        return None
+    first, last = levels[0]["stages"], levels[-1]["stages"]
+    growth = {name: last.get(name, 0.0) - first.get(name, 0.0) for name in set(first) | set(last)}
+    return max(growth, key=growth.get) if growth else None
+
+
+def print_report(levels: List[dict], slo_ms: float) -> None:
+    stage_names = sorted({name for level in levels for name in level["stages"]})
+    print()
+    print(f"{'VU':>4} {'tours':>6} {'tours/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err':>4} {'dégr.':>5} {'inatt.':>6}  "
+          + " ".join(f"{name[:8]:>8}" for name in stage_names))
+    for level in levels:
+        print(
+            f"{level['users']:>4} {level['turns']:>6} {level['throughput']:>8.2f} "
+            f"{level['p50'] * 1000:>8.0f} {level['p95'] * 1000:>8.0f} {level['p99'] * 1000:>8.0f} "
+            f"{level['errors']:>4} {level['degraded']:>5} {level['unexpected']:>6}  "
+            + " ".join(f"{level['stages'].get(name, 0.0) * 1000:>8.0f}" for name in stage_names)
+        )
+    print("(colonnes d'étapes : ms moyennes par tour)")
+
+    # Courbe p99 vs concurrence
+    print("\np99 par palier :")
+    worst = max((level["p99"] for level in levels), default=0) or 1
+    for level in levels:
+        bar = "#" * max(int(40 * level["p99"] / worst), 1)
+        flag = "  > SLO" if level["p99"] * 1000 > slo_ms else ""
+        print(f"{level['users']:>4} VU | {bar} {level['p99'] * 1000:.0f} ms{flag}")
+
+    ok = [level["users"] for level in levels if level["p99"] * 1000 <= slo_ms and not level["errors"]]
+    print()
+    if ok:
+        print(f"Capacité : {max(ok)} utilisateurs simultanés avec p99 <= {slo_ms:.0f} ms")
+    else:
+        print(f"Capacité : p99 > {slo_ms:.0f} ms dès le premier palier")
+    stage = saturating_stage(levels)
+    if stage:
+        print(f"Étape qui sature : {stage}")
+
+
+# ---------------------------
+# CLI
+# ---------------------------
+
+def _in_process_client(args) -> httpx.AsyncClient:
+    # Pas de warmer ni de journal d'intentions pendant le test
+    os.environ["CACHE_WARMING"] = "0"
+    os.environ["INTENT_LOG"] = "0"
+
+    from bench.fakes import install_fakes
+    import main
+
+    install_fakes(args.llm_ms, args.llm_parallel, args.amadeus_ms, args.sheets_ms, args.seed)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest", timeout=120)
+
+
+async def _main(args) -> None:
+    conversations = load_recorded(args.recorded) if args.recorded else load_transcripts(args.transcripts)
+    if not conversations:
+        raise SystemExit("Aucune conversation à rejouer.")
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=120)
+    else:
+        client = _in_process_client(args)
+
+    levels = []
+    async with client:
+        for users in [int(u) for u in args.users.split(",")]:
+            print(f"palier {users} VU ({args.duration:.0f} s)...", flush=True)
+            results = await run_level(client, conversations, users, args.duration, args.think_scale, args.seed)
+            levels.append(summarize(users, args.duration, results))
+
+    print_report(levels, args.p99_slo_ms)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"levels": levels, "saturating_stage": saturating_stage(levels)}, f, indent=2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test /chat avec des conversations réalistes")
+    parser.add_argument("--url", help="serveur à tester (sinon app en process avec services simulés)")
+    parser.add_argument("--transcripts", default=TRANSCRIPTS_PATH)
+    parser.add_argument("--recorded", help="journal JSONL de tours réels à rejouer")
+    parser.add_argument("--users", default="1,2,4,8,16", help="paliers d'utilisateurs virtuels")
+    parser.add_argument("--duration", type=float, default=30, help="durée de chaque palier (s)")
+    parser.add_argument("--think-scale", type=float, default=1.0, help="multiplie les temps de réflexion")
+    parser.add_argument("--p99-slo-ms", type=float, default=5000)
+    parser.add_argument("--llm-ms", type=float, default=600, help="[process] temps de service Ollama")
+    parser.add_argument("--llm-parallel", type=int, default=1, help="[process] slots Ollama (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--amadeus-ms", type=float, default=400, help="[process] temps de service Amadeus")
+    parser.add_argument("--sheets-ms", type=float, default=300, help="[process] temps d'écriture Sheets")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="écrit aussi le rapport en JSON")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,43 @@
-from fastapi import FastAPI
+import hmac
+import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
-from mcp.controller import handle_chat
+from typing import List, Optional
+from mcp import cache, profiling, stages, warmer
+from mcp.controller import chat_events, handle_chat
+from mcp.deadline import Deadline
 from mcp.googleProvider import save_reservation_to_sheet
+from responses import CompressionMiddleware, FastJSONResponse, dumps
 
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+# Budget temps total d'un tour /chat (LLM + Amadeus), en secondes
+CHAT_DEADLINE_S = float(os.getenv("CHAT_DEADLINE_S", "25"))
+
+# Compression des réponses au-dessus de ce nombre d'octets (RESPONSE_COMPRESSION=0 pour désactiver)
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "1") == "1"
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+# Jeton des endpoints /admin (en-tête X-Admin-Token) ; vide = endpoints désactivés
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmer.start()  # préchauffage du cache des recherches populaires
+    yield
+    warmer.stop()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+if RESPONSE_COMPRESSION:
+    # /chat/stream exclu : la compression retiendrait les événements progressifs
+    app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_BYTES, skip_paths=["/chat/stream"])
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,13 +64,94 @@ class ReservationRequest(BaseModel):
     dateA: str
     nbr: int
     prix: str
+    dateR: Optional[str] = None  # retour d'un aller-retour
+
+# Modèles de réponse : documentation OpenAPI uniquement. Les données viennent du controller
+# (de confiance), /chat renvoie directement une FastJSONResponse sans re-validation.
+class Place(BaseModel):
+    iata: Optional[str] = None
+    at: Optional[str] = None
+
+class Itinerary(BaseModel):
+    departure: Place
+    arrival: Place
+    stops: int = 0
+    duration: Optional[str] = None
+
+class Flight(BaseModel):
+    id: Optional[str] = None
+    airline: Optional[str] = None
+    departure: Place
+    arrival: Place
+    price: Optional[str] = None
+    priceValue: float
+    currency: Optional[str] = None
+    stops: int = 0
+    duration: Optional[str] = None
+    itineraries: List[Itinerary] = []
+    multiCity: bool = False
+
+class Hotel(BaseModel):
+    id: Optional[str] = None
+    name: Optional[str] = None
+    cityCode: Optional[str] = None
+    cheapestOffer: Optional[dict] = None
+    priceValue: float
+    roomDetails: Optional[dict] = None
 
-@app.post("/chat")
+class ChatResponse(BaseModel):
+    session_id: Optional[str] = None
+    answer: str
+    flights: Optional[List[Flight]] = None
+    hotels: Optional[List[Hotel]] = None
+    followup: Optional[str] = None
+    roomDetails: Optional[List[dict]] = None
+    reservation: Optional[dict] = None
+
+@app.post("/chat", response_model=ChatResponse)
 def chat(req: ChatRequest):
-    try:
-        return handle_chat(req.message, req.session_id)
-    except Exception as e:
-        return {"answer": f"Erreur: {str(e)}"}
+    start = time.perf_counter()
+    turn = profiling.begin("/chat", req.message, req.session_id)
+    error = None
+    with stages.collect() as timings, profiling.running(turn):
+        try:
+            payload = handle_chat(req.message, req.session_id, deadline=Deadline(CHAT_DEADLINE_S))
+        except Exception as e:
+            error = e
+            payload = {"answer": f"Erreur: {str(e)}"}
+    profiling.end(turn, timings, error)
+
+    response = FastJSONResponse(payload)
+    # Temps par étape (llm, amadeus, sheets...) : visible dans les outils réseau du navigateur et le load-test
+    response.headers["Server-Timing"] = stages.server_timing_header(timings, time.perf_counter() - start)
+    return response
+
+@app.post("/chat/stream")
+def chat_stream(req: ChatRequest):
+    """
+    Mode progressif : une ligne JSON par événement (ack, partial..., final).
+    """
+    deadline = Deadline(CHAT_DEADLINE_S)
+
+    def events():
+        turn = profiling.begin("/chat/stream", req.message, req.session_id)
+        timings, error = {}, None
+        turn_events = chat_events(req.message, req.session_id, deadline)
+        try:
+            while True:
+                # Chaque next() peut tourner sur un autre thread : on y rattache le collecteur et le tour profilé
+                with stages.collect(timings), profiling.running(turn):
+                    event = next(turn_events, None)
+                if event is None:
+                    break
+                yield dumps(event) + b"\n"
+        except Exception as e:
+            error = e
+            yield dumps({"type": "final", "session_id": req.session_id, "answer": f"Erreur: {str(e)}"}) + b"\n"
+        finally:
+            profiling.end(turn, timings, error)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 @app.post("/reserve")
 def reserve(req: ReservationRequest):
@@ -47,4 +159,30 @@ def reserve(req: ReservationRequest):
         save_reservation_to_sheet(req.dict())
         return {"success": True, "message": "Réservation enregistrée !"}
     except Exception as e:
-        return {"success": False, "message": str(e)}
\ No newline at end of file
+        return {"success": False, "message": str(e)}
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {"cache": cache.stats(), "warmer": warmer.stats()}
+
+def _check_admin(token: Optional[str]):
+    if not ADMIN_TOKEN or not hmac.compare_digest((token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Accès admin refusé")
+
+@app.get("/admin/slow-turns")
+def slow_turns(x_admin_token: Optional[str] = Header(None)):
+    """Tours les plus lents capturés (PROFILING=1) : durée, étapes, intention, entrées anonymisées."""
+    _check_admin(x_admin_token)
+    return {"profiling": profiling.stats(), "turns": profiling.slow_turns()}
+
+@app.get("/admin/slow-turns/flamegraph", response_class=PlainTextResponse)
+def slow_turns_flamegraph(turn_id: Optional[int] = None, x_admin_token: Optional[str] = Header(None)):
+    """Piles échantillonnées au format collapsed : flamegraph.pl, speedscope, inferno..."""
+    _check_admin(x_admin_token)
+    return PlainTextResponse(profiling.collapsed_stacks(turn_id))
+
+@app.delete("/admin/slow-turns")
+def clear_slow_turns(x_admin_token: Optional[str] = Header(None)):
+    _check_admin(x_admin_token)
+    profiling.clear()
+    return {"success": True}
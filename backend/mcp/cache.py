@@ -0,0 +1,154 @@
+"""
+Cache mémoire des recherches Amadeus (vols / hôtels) + compteurs de fréquence.
+
+Les compteurs servent au warmer (mcp/warmer.py) pour apprendre les requêtes
+populaires : ils décroissent avec le temps (demi-vie), sont bornés en nombre et
+oublient les requêtes dont la date est passée. Chaque entrée garde sa source ("user" ou "warm") pour mesurer
+le taux de hits obtenus grâce au préchauffage.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+CACHE_TTL_S = float(os.getenv("SEARCH_CACHE_TTL_S", "900"))
+CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "500"))
+# Compteurs de fréquence : divisés par 2 toutes les FREQ_HALF_LIFE_S secondes ("populaire" = récent)
+FREQ_HALF_LIFE_S = float(os.getenv("SEARCH_FREQ_HALF_LIFE_S", "86400"))
+FREQ_MAX_KEYS = int(os.getenv("SEARCH_FREQ_MAX_KEYS", "2000"))
+
+_lock = threading.Lock()
+_entries: Dict[str, dict] = {}
+_frequencies: Counter = Counter()
+_queries: Dict[str, Tuple[str, dict]] = {}  # clé -> (kind, query) pour les requêtes comptées
+_last_decay = time.monotonic()
+
+_stats = {"hits": 0, "misses": 0, "warm_hits": 0, "warm_puts": 0, "user_puts": 0}
+
+
+def make_key(kind: str, query: dict) -> str:
+    normalized = {
+        k: (v.strip().upper() if isinstance(v, str) else v)
+        for k, v in (query or {}).items()
+        if v is not None
+    }
+    return f"{kind}:{json.dumps(normalized, sort_keys=True, default=str)}"
+
+
+def get(kind: str, query: dict) -> Optional[Any]:
+    key = make_key(kind, query)
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry["expires_at"] <= now:
+            _stats["misses"] += 1
+            return None
+        _stats["hits"] += 1
+        entry["hits"] += 1
+        if entry["source"] == "warm":
+            _stats["warm_hits"] += 1
+        return entry["value"]
+
+
+def put(kind: str, query: dict, value: Any, source: str = "user", ttl: float = CACHE_TTL_S) -> None:
+    key = make_key(kind, query)
+    with _lock:
+        if len(_entries) >= CACHE_MAX_ENTRIES and key not in _entries:
+            # On libère l'entrée qui expire le plus tôt
+            oldest = min(_entries, key=lambda k: _entries[k]["expires_at"])
+            del _entries[oldest]
+        _entries[key] = {
+            "value": value,
+            "expires_at": time.monotonic() + ttl,
+            "source": source,
+            "hits": 0,
+        }
+        _stats["warm_puts" if source == "warm" else "user_puts"] += 1
+
+
+def ttl_left(kind: str, query: dict) -> float:
+    """Secondes avant expiration (0 si absent ou expiré)."""
+    with _lock:
+        entry = _entries.get(make_key(kind, query))
+    if entry is None:
+        return 0.0
+    return max(entry["expires_at"] - time.monotonic(), 0.0)
+
+
+def is_past(kind: str, query: dict) -> bool:
+    """Recherche dont la date (départ / arrivée à l'hôtel) est déjà passée."""
+    day = (query or {}).get("departureDate" if kind == "flights" else "checkin")
+    return bool(day) and str(day) < date.today().isoformat()
+
+
+def _forget(key: str) -> None:
+    _frequencies.pop(key, None)
+    _queries.pop(key, None)
+
+
+def _decay() -> None:
+    """Divise les compteurs par 2 à chaque demi-vie écoulée et oublie les requêtes passées (sous _lock)."""
+    global _last_decay
+    now = time.monotonic()
+    periods = int((now - _last_decay) // FREQ_HALF_LIFE_S)
+    if periods <= 0:
+        return
+    _last_decay += periods * FREQ_HALF_LIFE_S
+    factor = 0.5 ** periods
+    for key in list(_frequencies):
+        _frequencies[key] *= factor
+        if _frequencies[key] < 0.5 or is_past(*_queries[key]):
+            _forget(key)
+
+
+def record_search(kind: str, query: dict) -> None:
+    if is_past(kind, query):
+        return
+    key = make_key(kind, query)
+    with _lock:
+        _decay()
+        _frequencies[key] += 1
+        _queries[key] = (kind, dict(query))
+        if len(_frequencies) > FREQ_MAX_KEYS:
+            # On oublie la requête la moins demandée récemment
+            _forget(min(_frequencies, key=_frequencies.get))
+
+
+def hot_queries(n: int, min_count: int = 2) -> List[Tuple[str, dict]]:
+    """Les n requêtes utilisateur les plus demandées récemment (kind, query), dates passées exclues."""
+    with _lock:
+        _decay()
+        ranked = [
+            (count, _queries[key]) for key, count in _frequencies.items()
+            if count >= min_count and not is_past(*_queries[key])
+        ]
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    return [query for _, query in ranked[:n]]
+
+
+def stats() -> dict:
+    with _lock:
+        s = dict(_stats)
+        s["entries"] = len(_entries)
+        warm_entries = [e for e in _entries.values() if e["source"] == "warm"]
+    lookups = s["hits"] + s["misses"]
+    s["hit_rate"] = s["hits"] / lookups if lookups else 0.0
+    s["warm_hit_rate"] = s["warm_hits"] / lookups if lookups else 0.0
+    # Part des entrées préchauffées encore en cache qui ont servi au moins une fois
+    s["warm_entries"] = len(warm_entries)
+    s["warm_entries_used"] = sum(1 for e in warm_entries if e["hits"] > 0)
+    return s
+
+
+def clear() -> None:
+    with _lock:
+        _entries.clear()
+        _frequencies.clear()
+        _queries.clear()
+        for k in _stats:
+            _stats[k] = 0
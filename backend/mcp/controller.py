@@ -1,14 +1,25 @@
 from __future__ import annotations
 
+import heapq
 import re
 import uuid
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
+from mcp import profiling
+from mcp.deadline import Deadline, DeadlineExceeded
+from mcp.intent import classify_intent, log_labelled_message
 from mcp.session import get_session, update_session
+from mcp.stages import stage
 from mcp.recommender import get_activity_suggestions
 from mcp.googleProvider import save_reservation_to_sheet
-from mcp.model import ask_model_to_process, extract_flight_query, extract_hotel_query, process_user_message
-from mcp.provider import search_flights, search_hotels
+from mcp.model import (
+    ask_model_to_process,
+    extract_booking_query,
+    extract_flight_query,
+    extract_hotel_query,
+    process_user_message,
+)
+from mcp.provider import iter_multi_city, search_flights, stream_hotels
 
 DATE_RE = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
 
@@ -63,32 +74,60 @@ def _flight_need_info_answer() -> str:
     )
 
 
+def _timeout_answer() -> str:
+    return (
+        "⏱️ La recherche prend plus de temps que prévu, je préfère ne pas te faire attendre.\n"
+        "Réessaie dans un instant ou précise ta demande (villes, dates)."
+    )
+
+
 # ---------------------------
 # FORMAT / TRI DES DONNÉES
 # ---------------------------
 
+def _compact_itinerary(it: Any) -> Optional[dict]:
+    if not isinstance(it, dict):
+        return None
+
+    segments = it.get("segments") or []
+    if not segments or not isinstance(segments, list):
+        return None
+
+    first_seg = segments[0] if isinstance(segments[0], dict) else None
+    last_seg = segments[-1] if isinstance(segments[-1], dict) else None
+    if not first_seg or not last_seg:
+        return None
+
+    dep = first_seg.get("departure") or {}
+    arr = last_seg.get("arrival") or {}
+
+    return {
+        "departure": {"iata": dep.get("iataCode"), "at": dep.get("at")},
+        "arrival": {"iata": arr.get("iataCode"), "at": arr.get("at")},
+        "stops": max(len(segments) - 1, 0),
+        "duration": it.get("duration"),  # ex: PT1H20M (si présent)
+    }
+
+
 def format_flight_data(raw_flights: List[dict]) -> List[dict]:
+    """
+    Une offre = un enregistrement compact. Les champs departure/arrival/stops/duration
+    décrivent le 1er trajet (l'aller) ; "itineraries" contient tous les trajets
+    (aller + retour pour un aller-retour).
+    """
     formatted: List[dict] = []
     for flight in raw_flights or []:
         if not isinstance(flight, dict):
             continue
 
         itineraries = flight.get("itineraries") or []
-        if not itineraries or not isinstance(itineraries, list) or not isinstance(itineraries[0], dict):
-            continue
-
-        it0 = itineraries[0]
-        segments = it0.get("segments") or []
-        if not segments or not isinstance(segments, list):
+        if not itineraries or not isinstance(itineraries, list):
             continue
 
-        first_seg = segments[0] if isinstance(segments[0], dict) else None
-        last_seg = segments[-1] if isinstance(segments[-1], dict) else None
-        if not first_seg or not last_seg:
+        compact = [_compact_itinerary(it) for it in itineraries]
+        if any(c is None for c in compact):
             continue
-
-        dep = first_seg.get("departure") or {}
-        arr = last_seg.get("arrival") or {}
+        it0 = compact[0]
 
         airline_codes = flight.get("validatingAirlineCodes") or []
         airline = airline_codes[0] if airline_codes else None
@@ -101,13 +140,14 @@ def format_flight_data(raw_flights: List[dict]) -> List[dict]:
             {
                 "id": flight.get("id"),
                 "airline": airline,
-                "departure": {"iata": dep.get("iataCode"), "at": dep.get("at")},
-                "arrival": {"iata": arr.get("iataCode"), "at": arr.get("at")},
+                "departure": it0["departure"],
+                "arrival": it0["arrival"],
                 "price": total,
                 "priceValue": _safe_float(total),
                 "currency": currency,
-                "stops": max(len(segments) - 1, 0),
-                "duration": it0.get("duration"),  # ex: PT1H20M (si présent)
+                "stops": it0["stops"],
+                "duration": it0["duration"],
+                "itineraries": compact,
             }
         )
 
@@ -116,6 +156,53 @@ def format_flight_data(raw_flights: List[dict]) -> List[dict]:
     return formatted
 
 
+def combine_legs(flights_by_leg: List[List[dict]], limit: int = 5) -> List[dict]:
+    """
+    Multi-destinations : les `limit` combinaisons (un vol par étape) les moins chères.
+    Chaque liste est déjà triée par prix : on parcourt les sommes croissantes avec un tas
+    au lieu de générer le produit cartésien complet.
+    """
+    if not flights_by_leg or any(not leg for leg in flights_by_leg):
+        return []
+
+    def _total(idx: tuple) -> float:
+        return sum(flights_by_leg[leg][i]["priceValue"] for leg, i in enumerate(idx))
+
+    start = tuple(0 for _ in flights_by_leg)
+    heap = [(_total(start), start)]
+    seen = {start}
+    combos: List[dict] = []
+
+    while heap and len(combos) < limit:
+        total, idx = heapq.heappop(heap)
+        legs = [flights_by_leg[leg][i] for leg, i in enumerate(idx)]
+        currency = legs[0].get("currency")
+        combos.append(
+            {
+                "id": "+".join(str(f.get("id")) for f in legs),
+                "airline": "/".join(dict.fromkeys(f.get("airline") or "-" for f in legs)),
+                "departure": legs[0]["departure"],
+                "arrival": legs[-1]["arrival"],
+                "price": f"{total:.2f}",
+                "priceValue": total,
+                "currency": currency,
+                "stops": sum(f.get("stops", 0) for f in legs),
+                "duration": None,
+                "itineraries": [it for f in legs for it in f.get("itineraries", [])],
+                "multiCity": True,
+            }
+        )
+
+        for leg in range(len(idx)):
+            if idx[leg] + 1 < len(flights_by_leg[leg]):
+                nxt = idx[:leg] + (idx[leg] + 1,) + idx[leg + 1:]
+                if nxt not in seen:
+                    seen.add(nxt)
+                    heapq.heappush(heap, (_total(nxt), nxt))
+
+    return combos
+
+
 def format_hotel_data(raw_hotels: Any) -> List[dict]:
     items = raw_hotels if isinstance(raw_hotels, list) else []
     formatted: List[dict] = []
@@ -207,31 +294,38 @@ def format_hotel_data(raw_hotels: Any) -> List[dict]:
 # RENDU TEXTE (PROPRE)
 # ---------------------------
 
+def _itinerary_label(f: dict, i: int) -> str:
+    if f.get("multiCity"):
+        return f"Étape {i}"
+    if len(f.get("itineraries") or []) > 1:
+        return "Aller" if i == 1 else "Retour"
+    return "Trajet"
+
+
 def _flights_to_text(flights: List[dict]) -> str:
     lines: List[str] = []
     for i, f in enumerate(flights, start=1):
         airline = f.get("airline") or "-"
-        dep = f.get("departure") or {}
-        arr = f.get("arrival") or {}
         price = f.get("price")
         cur = f.get("currency") or ""
-        dep_iata = dep.get("iata") or "-"
-        arr_iata = arr.get("iata") or "-"
-        dep_at = _fmt_dt(dep.get("at"))
-        arr_at = _fmt_dt(arr.get("at"))
-        stops = f.get("stops", 0)
 
         tag = " (Le moins cher)" if i == 1 else ""
         price_txt = f"{price} {cur}".strip() if price is not None else "-"
 
-        lines.append(
-            f"{i}. {airline}{tag}\n"
-            f"   - Trajet : {dep_iata} → {arr_iata}\n"
-            f"   - Départ : {dep_at}\n"
-            f"   - Arrivée : {arr_at}\n"
-            f"   - Escales : {stops}\n"
-            f"   - Prix : {price_txt}"
-        )
+        lines.append(f"{i}. {airline}{tag}")
+        itineraries = f.get("itineraries") or [
+            {"departure": f.get("departure"), "arrival": f.get("arrival"), "stops": f.get("stops", 0)}
+        ]
+        for n, it in enumerate(itineraries, start=1):
+            dep = it.get("departure") or {}
+            arr = it.get("arrival") or {}
+            lines.append(
+                f"   - {_itinerary_label(f, n)} : {dep.get('iata') or '-'} → {arr.get('iata') or '-'}\n"
+                f"   - Départ : {_fmt_dt(dep.get('at'))}\n"
+                f"   - Arrivée : {_fmt_dt(arr.get('at'))}\n"
+                f"   - Escales : {it.get('stops', 0)}"
+            )
+        lines.append(f"   - Prix : {price_txt}")
     return "\n".join(lines)
 
 
@@ -288,66 +382,163 @@ def _room_details_to_text(room_details_by_hotel: List[dict]) -> str:
     return "\n".join(lines).rstrip()
 
 
+def _build_flight_queries(data: dict) -> List[dict]:
+    """
+    Requêtes Amadeus à partir des champs extraits :
+    - multi-destinations (legs >= 2) : un aller simple par étape
+    - sinon une seule requête, avec returnDate pour un aller-retour (natif Amadeus)
+    """
+    adults = int(data.get("adults") or 1)
+    legs = [
+        leg for leg in (data.get("legs") or [])
+        if isinstance(leg, dict)
+        and leg.get("originLocationCode") and leg.get("destinationLocationCode") and leg.get("departureDate")
+    ]
+    if len(legs) >= 2:
+        return [
+            {
+                "originLocationCode": leg["originLocationCode"],
+                "destinationLocationCode": leg["destinationLocationCode"],
+                "departureDate": leg["departureDate"],
+                "adults": adults,
+                "max": 5,
+            }
+            for leg in legs
+        ]
+
+    q = {
+        "originLocationCode": data["originLocationCode"],
+        "destinationLocationCode": data["destinationLocationCode"],
+        "departureDate": data["departureDate"],
+        "adults": adults,
+        "max": 5,
+    }
+    if data.get("returnDate"):
+        q["returnDate"] = data["returnDate"]
+    return [q]
+
+
+def _route_label(queries: List[dict]) -> str:
+    stops = [queries[0]["originLocationCode"]] + [q["destinationLocationCode"] for q in queries]
+    label = " -> ".join(stops)
+    if len(queries) == 1 and queries[0].get("returnDate"):
+        label += ", aller-retour"
+    return label
+
+
 # ---------------------------
 # MAIN HANDLER /CHAT
 # ---------------------------
 
-def handle_chat(message: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+def _ack(session_id: str, intent: Optional[str], query: Any = None) -> Dict[str, Any]:
+    return {"type": "ack", "session_id": session_id, "intent": intent, "query": query}
+
+
+def _partial(session_id: str, kind: str, results: List[dict], **extra: Any) -> Dict[str, Any]:
+    return {"type": "partial", "session_id": session_id, "kind": kind, "results": results, **extra}
+
+
+def _final(session_id: str, answer: str, **extra: Any) -> Dict[str, Any]:
+    return {"type": "final", "session_id": session_id, "answer": answer, **extra}
+
+
+def handle_chat(message: str, session_id: Optional[str] = None, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """Réponse complète d'un tour /chat : le dernier événement de chat_events."""
+    final: Dict[str, Any] = {}
+    for event in chat_events(message, session_id, deadline):
+        if event["type"] == "final":
+            final = event
+    return {k: v for k, v in final.items() if k != "type"}
+
+
+def chat_events(message: str, session_id: Optional[str] = None, deadline: Optional[Deadline] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Déroulé progressif d'un tour de conversation (utilisé par /chat/stream) :
+    - "ack" : intention (et requête extraite) dès que l'analyse est finie
+    - "partial" : résultats classés au fur et à mesure des réponses Amadeus
+    - "final" : classement final, texte de réponse et question de suivi éventuelle
+    """
     msg = (message or "").strip()
     lower = msg.lower()
 
     if not session_id:
         session_id = str(uuid.uuid4())
 
-    # 1. ANALYSE DE L'INTENTION PAR L'IA (LLM)
-    analysis = {}
-    try:
-        analysis = ask_model_to_process(msg)
-        intent = analysis.get("intent")
-        
-        # Cas spécifique : Suggestions d'activités
-        if intent == "advice":
-            return get_activity_suggestions(msg, session_id)
-            
-    except Exception as e:
-        print(f"Erreur analyse IA : {e}")
-        intent = None
-
     # Récupération de la session actuelle
     session = get_session(session_id) or {}
 
-    # 2. FOLLOW-UP : Infos de chambre (Si on attendait une réponse oui/non)
+    # 1. FOLLOW-UP : Infos de chambre (Si on attendait une réponse oui/non)
+    # Avant l'analyse d'intention : un « oui » / « non » ne doit pas partir vers le LLM
     if session.get("state") == "awaiting_room_details":
         if _is_yes(msg):
+            profiling.annotate(intent="room_details", intent_source="followup")
+            yield _ack(session_id, "room_details")
             payload = session.get("room_details_payload") or []
             if not payload:
                 update_session(session_id, {"state": "idle", "room_details_payload": []})
-                return {"session_id": session_id, "answer": "Je n’ai pas d’infos chambre supplémentaires."}
+                yield _final(session_id, "Je n’ai pas d’infos chambre supplémentaires.")
+                return
 
             answer = _room_details_to_text(payload)
             update_session(session_id, {"state": "idle", "room_details_payload": []})
-            return {"session_id": session_id, "answer": answer}
+            yield _final(session_id, answer, roomDetails=payload)
+            return
 
         if _is_no(msg):
+            profiling.annotate(intent="room_details", intent_source="followup")
+            yield _ack(session_id, "room_details")
             update_session(session_id, {"state": "idle", "room_details_payload": []})
-            return {"session_id": session_id, "answer": "Ok, je reste sur ces résultats."}
+            yield _final(session_id, "Ok, je reste sur ces résultats.")
+            return
+
+    # 2. ANALYSE DE L'INTENTION : classifieur local, puis LLM si pas assez confiant
+    analysis = {}
+    try:
+        with stage("intent"):
+            intent, _confidence = classify_intent(msg)
+        if intent:
+            analysis = {"intent": intent, "source": "local"}
+        else:
+            analysis = ask_model_to_process(msg, deadline)
+            intent = analysis.get("intent")
+            log_labelled_message(msg, intent)
+        profiling.annotate(intent=intent, intent_source=analysis.get("source", "llm"))
+        
+        # Cas spécifique : Suggestions d'activités
+        if intent == "advice":
+            yield _ack(session_id, intent)
+            suggestion = get_activity_suggestions(msg, session_id, deadline)
+            yield _final(session_id, suggestion["answer"], flights=[], hotels=[])
+            return
+            
+    except Exception as e:
+        print(f"Erreur analyse IA : {e}")
+        intent = None
 
     # 3. INTENTION HÔTEL (Détectée par mot-clé OU par l'IA)
     if _is_hotel_intent(lower) or intent == "hotel":
         dates = DATE_RE.findall(msg)
         if len(dates) < 2:
-            return {"session_id": session_id, "answer": _hotel_need_dates_answer()}
+            yield _final(session_id, _hotel_need_dates_answer())
+            return
 
         try:
-            query = extract_hotel_query(msg)
-            raw_hotels = search_hotels(query)
-            hotels = format_hotel_data(raw_hotels)
+            query = extract_hotel_query(msg, deadline)
+            yield _ack(session_id, "hotel", query)
+
+            # Chaque lot d'offres Amadeus est fusionné dans le classement dès son arrivée
+            hotels: List[dict] = []
+            for raw_batch in stream_hotels(query, deadline):
+                hotels = sorted(hotels + format_hotel_data(raw_batch), key=lambda x: x.get("priceValue", 10**18))
+                yield _partial(session_id, "hotels", hotels)
 
             if not hotels:
-                return {
-                    "session_id": session_id,
-                    "answer": f"Aucun hôtel trouvé à {query['city_name']} du {query['checkin']} au {query['checkout']}.",
-                }
+                yield _final(
+                    session_id,
+                    f"Aucun hôtel trouvé à {query['city_name']} du {query['checkin']} au {query['checkout']}.",
+                    hotels=[],
+                )
+                return
 
             # Préparation des détails de chambre pour le follow-up
             with_room = [
@@ -360,8 +551,14 @@ def handle_chat(message: str, session_id: Optional[str] = None) -> Dict[str, Any
                 f"{_hotels_to_text(hotels)}"
             )
 
+            if not all(h.get("cheapestOffer") for h in hotels):
+                # Réponse partielle : la liste est arrivée mais pas tous les tarifs (budget temps épuisé)
+                answer += "\n\n⏱️ Certains tarifs n'ont pas pu être récupérés à temps, redemande-moi pour les obtenir."
+
+            followup = None
             if with_room:
-                answer += "\n\nJ'ai trouvé des détails sur les chambres (lits, conditions). Voulez-vous les voir ? (oui/non)"
+                followup = "J'ai trouvé des détails sur les chambres (lits, conditions). Voulez-vous les voir ? (oui/non)"
+                answer += "\n\n" + followup
                 update_session(session_id, {
                     "state": "awaiting_room_details", 
                     "room_details_payload": with_room[:5]
@@ -369,9 +566,12 @@ def handle_chat(message: str, session_id: Optional[str] = None) -> Dict[str, Any
             else:
                 update_session(session_id, {"state": "idle", "room_details_payload": []})
 
-            return {"session_id": session_id, "answer": answer}
+            yield _final(session_id, answer, hotels=hotels, followup=followup)
+        except DeadlineExceeded:
+            yield _final(session_id, _timeout_answer())
         except Exception as e:
-            return {"session_id": session_id, "answer": f"Erreur lors de la recherche d'hôtel : {str(e)}"}
+            yield _final(session_id, f"Erreur lors de la recherche d'hôtel : {str(e)}")
+        return
 
     # 4. INTENTION RÉSERVATION DE VOL (Book)
     if intent == "book":
@@ -379,13 +579,23 @@ def handle_chat(message: str, session_id: Optional[str] = None) -> Dict[str, Any
         last_q = session.get("last_query", {})
 
         if not flights:
-            return {"session_id": session_id, "answer": "❌ Cherchez d'abord un vol avant de réserver !"}
+            yield _final(session_id, "❌ Cherchez d'abord un vol avant de réserver !")
+            return
 
         try:
             # On récupère les infos via l'analyse déjà faite par ask_model_to_process
+            # (ou on les extrait maintenant si l'intention vient du classifieur local)
+            if analysis.get("source") == "local":
+                analysis.update(extract_booking_query(msg, deadline))
+            yield _ack(session_id, "book", {"flight_index": analysis.get("flight_index", 1)})
+
             idx_str = analysis.get("flight_index", 1)
             idx = max(int(idx_str) - 1, 0)
             selected = flights[min(idx, len(flights) - 1)]
+            # lieuA / dateA : même trajet (l'aller, ou la dernière étape en multi-destinations) ;
+            # aller-retour : date de départ du retour dans dateR
+            itineraries = selected.get("itineraries") or []
+            return_date = itineraries[-1]["departure"]["at"] if len(itineraries) == 2 and not selected.get("multiCity") else None
 
             reservation = {
                 "id": str(uuid.uuid4())[:8],
@@ -395,6 +605,7 @@ def handle_chat(message: str, session_id: Optional[str] = None) -> Dict[str, Any
                 "lieuA": selected["arrival"]["iata"],
                 "dateD": selected["departure"]["at"],
                 "dateA": selected["arrival"]["at"],
+                "dateR": return_date,
                 "nbr": last_q.get("adults", 1),
                 "prix": f"{selected['price']} {selected['currency']}",
             }
@@ -402,42 +613,60 @@ def handle_chat(message: str, session_id: Optional[str] = None) -> Dict[str, Any
             save_reservation_to_sheet(reservation)
             update_session(session_id, {"flights": [], "last_query": None, "state": "idle"})
 
-            return {
-                "session_id": session_id, 
-                "answer": f"✅ Réservation confirmée ! Réf: {reservation['id']}\nVol: {reservation['lieuD']} → {reservation['lieuA']}"
-            }
+            answer = f"✅ Réservation confirmée ! Réf: {reservation['id']}\nVol: {reservation['lieuD']} → {reservation['lieuA']}"
+            if return_date:
+                answer += f" (aller-retour, retour le {return_date[:10]})"
+            yield _final(session_id, answer, reservation=reservation)
+        except DeadlineExceeded:
+            yield _final(session_id, _timeout_answer())
         except Exception as e:
-            return {"session_id": session_id, "answer": f"Erreur réservation : {str(e)}"}
+            yield _final(session_id, f"Erreur réservation : {str(e)}")
+        return
 
     # 5. RECHERCHE DE VOL (Search / Par défaut)
     try:
         # On tente d'utiliser les données extraites par l'IA si dispo, sinon on force l'extraction
-        if intent == "search" and analysis.get("originLocationCode"):
-            q = {
-                "originLocationCode": analysis["originLocationCode"],
-                "destinationLocationCode": analysis["destinationLocationCode"],
-                "departureDate": analysis["departureDate"],
-                "adults": int(analysis.get("adults", 1)),
-                "max": 5
-            }
+        if intent == "search" and (analysis.get("originLocationCode") or analysis.get("legs")):
+            queries = _build_flight_queries(analysis)
         else:
             # Fallback sur l'extracteur manuel
-            q = extract_flight_query(msg)
-            q["max"] = 5
+            queries = _build_flight_queries(extract_flight_query(msg, deadline))
+    except DeadlineExceeded:
+        yield _final(session_id, _timeout_answer())
+        return
+    except Exception:
+        # Si rien n'a matché et que l'extraction de vol échoue aussi
+        yield _final(session_id, _flight_need_info_answer())
+        return
 
-        raw_flights = search_flights(q)
-        flights = format_flight_data(raw_flights)
+    try:
+        yield _ack(session_id, "search", queries if len(queries) > 1 else queries[0])
+
+        if len(queries) == 1:
+            flights = format_flight_data(search_flights(queries[0], deadline))
+        else:
+            # Multi-destinations : étapes récupérées en parallèle puis combinées par prix total
+            flights_by_leg: List[List[dict]] = [[] for _ in queries]
+            for leg, raw in iter_multi_city(queries, deadline):
+                flights_by_leg[leg] = format_flight_data(raw)
+                yield _partial(session_id, "flights", flights_by_leg[leg], leg=leg)
+            flights = combine_legs(flights_by_leg)
 
         if not flights:
-            return {"session_id": session_id, "answer": "Aucun vol trouvé pour ces critères."}
+            yield _final(session_id, "Aucun vol trouvé pour ces critères.", flights=[])
+            return
 
+        q = queries[0]
         update_session(session_id, {"flights": flights, "last_query": q, "state": "awaiting_reservation"})
         
-        return {
-            "session_id": session_id, 
-            "answer": f"✈️ Vols trouvés ({q['originLocationCode']} -> {q['destinationLocationCode']}) :\n\n{_flights_to_text(flights)}"
-        }
+        yield _final(
+            session_id,
+            f"✈️ Vols trouvés ({_route_label(queries)}) :\n\n{_flights_to_text(flights)}",
+            flights=flights,
+            followup="Pour réserver, indique le numéro du vol (ex : « je réserve le vol 1 »).",
+        )
 
+    except DeadlineExceeded:
+        yield _final(session_id, _timeout_answer())
     except Exception:
-        # Si rien n'a matché et que l'extraction de vol échoue aussi
-        return {"session_id": session_id, "answer": _flight_need_info_answer()}
\ No newline at end of file
+        yield _final(session_id, _flight_need_info_answer())
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import time
+from typing import Optional
+
+# En dessous de ce temps restant, on n'essaie même plus d'appeler un service externe
+MIN_STAGE_TIMEOUT_S = 0.05
+
+
+class DeadlineExceeded(TimeoutError):
+    """Le budget temps de la requête /chat est épuisé."""
+
+
+class Deadline:
+    """
+    Budget temps global d'une requête /chat.
+    Créé dans main.py puis transmis au controller, au modèle et au provider :
+    chaque étape n'utilise que le temps qu'il reste.
+    """
+
+    def __init__(self, budget_s: float):
+        self.budget_s = float(budget_s)
+        self.expires_at = time.monotonic() + self.budget_s
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= MIN_STAGE_TIMEOUT_S
+
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.2f}s / {self.budget_s:.2f}s)"
+
+
+def timeout_for(deadline: Optional[Deadline], cap: Optional[float] = None) -> Optional[float]:
+    """
+    Timeout à utiliser pour une étape :
+    - sans deadline : le timeout fixe de l'étape (cap)
+    - avec deadline : min(cap, temps restant), DeadlineExceeded si plus rien
+    """
+    if deadline is None:
+        return cap
+
+    remaining = deadline.remaining()
+    if remaining <= MIN_STAGE_TIMEOUT_S:
+        raise DeadlineExceeded(f"Budget de {deadline.budget_s:.1f}s épuisé")
+
+    return remaining if cap is None else min(cap, remaining)
@@ -2,9 +2,11 @@ from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 import os
 
+from mcp.stages import stage
+
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 SPREADSHEET_ID = "1pJRBN0mEt4xiMCGKicFff04mqrJEC4KF9B7J7h9e6Qc"
-RANGE_NAME = "reservation!A:I"  # adapte si besoin
+RANGE_NAME = "reservation!A:J"  # adapte si besoin
 CREDENTIALS_PATH = os.path.join(os.path.dirname(__file__), "famous-empire-477209-f1-eec914cd4569.json")
 
 def save_reservation_to_sheet(data: dict):
@@ -26,15 +28,17 @@ def save_reservation_to_sheet(data: dict):
         data["dateA"],
         data["nbr"],
         data["prix"],
+        data.get("dateR") or "",  # date du vol retour (aller-retour uniquement)
     ]]
 
     body = {
         "values": values
     }
 
-    sheet.values().append(
-        spreadsheetId=SPREADSHEET_ID,
-        range=RANGE_NAME,
-        valueInputOption="USER_ENTERED",
-        body=body
-    ).execute()
+    with stage("sheets"):
+        sheet.values().append(
+            spreadsheetId=SPREADSHEET_ID,
+            range=RANGE_NAME,
+            valueInputOption="USER_ENTERED",
+            body=body
+        ).execute()
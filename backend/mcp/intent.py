@@ -0,0 +1,351 @@
+"""
+Classifieur d'intention local (search / book / hotel / advice).
+
+Régression logistique multi-classes sur des n-grammes de caractères hashés,
+100% Python, CPU, < 1 ms par message. Utilisé par le controller avant
+l'appel LLM : si la confiance est trop faible, on laisse le LLM décider
+(et, avec INTENT_LOG=1, on journalise sa réponse anonymisée pour le prochain entraînement).
+
+CLI (depuis backend/) :
+    python -m mcp.intent train                 # entraîne sur seed + logs
+    python -m mcp.intent evaluate              # précision, couverture, latence
+    python -m mcp.intent label messages.txt    # fait étiqueter des messages par le LLM
+    python -m mcp.intent predict "vol TLS CDG 2026-02-10"
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+import unicodedata
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from mcp.profiling import sanitize
+
+INTENTS = ("search", "book", "hotel", "advice")
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+SEED_PATH = os.path.join(DATA_DIR, "intent_seed.jsonl")
+MODEL_PATH = os.getenv("INTENT_MODEL_PATH", os.path.join(DATA_DIR, "intent_model.json"))
+LOG_PATH = os.getenv("INTENT_LOG_PATH", os.path.join(DATA_DIR, "intent_log.jsonl"))
+LOG_ENABLED = os.getenv("INTENT_LOG", "0") == "1"
+
+# En dessous de ce seuil de probabilité, on repasse par le LLM
+CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE", "0.8"))
+
+N_FEATURES = 2 ** 15
+NGRAM_MIN, NGRAM_MAX = 2, 4
+
+
+# ---------------------------
+# FEATURES
+# ---------------------------
+
+def _normalize(text: str) -> str:
+    t = unicodedata.normalize("NFKD", (text or "").lower())
+    t = "".join(c for c in t if not unicodedata.combining(c))
+    # Les chiffres n'ont pas de sens en soi : "2026-02-10" et "2025-11-03" doivent se ressembler
+    t = "".join("0" if c.isdigit() else c for c in t)
+    return " " + " ".join(t.split()) + " "
+
+
+def featurize(text: str) -> Dict[int, float]:
+    """n-grammes de caractères hashés (crc32, stable entre deux runs), normalisés L2."""
+    t = _normalize(text)
+    counts: Dict[int, float] = {}
+    for n in range(NGRAM_MIN, NGRAM_MAX + 1):
+        for i in range(len(t) - n + 1):
+            idx = zlib.crc32(t[i:i + n].encode("utf-8")) % N_FEATURES
+            counts[idx] = counts.get(idx, 0.0) + 1.0
+
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {k: v / norm for k, v in counts.items()}
+
+
+def _softmax(scores: List[float]) -> List[float]:
+    m = max(scores)
+    exps = [math.exp(s - m) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+
+# ---------------------------
+# MODELE
+# ---------------------------
+
+class IntentClassifier:
+    def __init__(self, classes: Iterable[str] = INTENTS):
+        self.classes = list(classes)
+        self.bias = [0.0] * len(self.classes)
+        # index de feature -> poids par classe (creux : seules les features vues sont stockées)
+        self.weights: Dict[int, List[float]] = {}
+
+    def _scores(self, x: Dict[int, float]) -> List[float]:
+        scores = list(self.bias)
+        k = len(self.classes)
+        for idx, v in x.items():
+            w = self.weights.get(idx)
+            if w is not None:
+                for c in range(k):
+                    scores[c] += w[c] * v
+        return scores
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        probs = _softmax(self._scores(featurize(text)))
+        return dict(zip(self.classes, probs))
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        probs = _softmax(self._scores(featurize(text)))
+        best = max(range(len(probs)), key=probs.__getitem__)
+        return self.classes[best], probs[best]
+
+    def fit(self, examples: List[dict], epochs: int = 30, lr: float = 0.5, l2: float = 1e-4, seed: int = 0) -> "IntentClassifier":
+        """SGD sur la log-vraisemblance (softmax), décroissance du pas à chaque epoch."""
+        rng = random.Random(seed)
+        data = [(featurize(e["message"]), self.classes.index(e["intent"])) for e in examples if e.get("intent") in self.classes]
+        k = len(self.classes)
+
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            step = lr / (1.0 + epoch * 0.2)
+            for x, y in data:
+                probs = _softmax(self._scores(x))
+                grads = [p - (1.0 if c == y else 0.0) for c, p in enumerate(probs)]
+                for c in range(k):
+                    self.bias[c] -= step * grads[c]
+                for idx, v in x.items():
+                    w = self.weights.setdefault(idx, [0.0] * k)
+                    for c in range(k):
+                        w[c] -= step * (grads[c] * v + l2 * w[c])
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "version": 1,
+            "classes": self.classes,
+            "n_features": N_FEATURES,
+            "ngram": [NGRAM_MIN, NGRAM_MAX],
+            "bias": self.bias,
+            "weights": {str(i): [round(v, 5) for v in w] for i, w in self.weights.items() if any(abs(v) > 1e-5 for v in w)},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "IntentClassifier":
+        if data.get("n_features") != N_FEATURES or data.get("ngram") != [NGRAM_MIN, NGRAM_MAX]:
+            raise ValueError("Modèle d'intention incompatible (features différentes), relancer l'entraînement.")
+        model = cls(data["classes"])
+        model.bias = list(data["bias"])
+        model.weights = {int(i): list(w) for i, w in data["weights"].items()}
+        return model
+
+    def save(self, path: str = MODEL_PATH) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH) -> "IntentClassifier":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+# ---------------------------
+# UTILISATION DEPUIS LE CONTROLLER
+# ---------------------------
+
+_model: Optional[IntentClassifier] = None
+_model_loaded = False
+_log_lock = threading.Lock()
+
+
+def _get_model() -> Optional[IntentClassifier]:
+    global _model, _model_loaded
+    if not _model_loaded:
+        _model_loaded = True
+        try:
+            _model = IntentClassifier.load(MODEL_PATH)
+        except FileNotFoundError:
+            _model = None
+        except Exception as e:
+            print(f"Erreur chargement modèle d'intention : {e}")
+            _model = None
+    return _model
+
+
+def classify_intent(message: str) -> Tuple[Optional[str], float]:
+    """
+    Retourne (intent, confiance). intent vaut None si aucun modèle n'est entraîné
+    ou si la confiance est sous CONFIDENCE_THRESHOLD : il faut alors demander au LLM.
+    """
+    model = _get_model()
+    if model is None or not (message or "").strip():
+        return None, 0.0
+
+    intent, confidence = model.predict(message)
+    if confidence < CONFIDENCE_THRESHOLD:
+        return None, confidence
+    return intent, confidence
+
+
+def log_labelled_message(message: str, intent: Optional[str], source: str = "llm", force: bool = False) -> None:
+    """
+    Journalise un message étiqueté (par le LLM), anonymisé, pour les prochains entraînements.
+    En service, seulement avec INTENT_LOG=1 ; la commande `label` écrit toujours (force=True).
+    """
+    if not (LOG_ENABLED or force) or intent not in INTENTS or not (message or "").strip():
+        return
+    # Pas de noms, emails ni numéros sur disque (tours de réservation notamment)
+    line = json.dumps({"message": sanitize(message), "intent": intent, "source": source}, ensure_ascii=False)
+    try:
+        with _log_lock, open(LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        print(f"Erreur écriture log d'intention : {e}")
+
+
+# ---------------------------
+# CLI
+# ---------------------------
+
+def load_examples(paths: Iterable[str]) -> List[dict]:
+    examples: List[dict] = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                if item.get("intent") in INTENTS and item.get("message"):
+                    examples.append(item)
+    return examples
+
+
+def _split(examples: List[dict], holdout: float, seed: int = 0) -> Tuple[List[dict], List[dict]]:
+    items = list(examples)
+    random.Random(seed).shuffle(items)
+    n_test = int(len(items) * holdout)
+    return items[n_test:], items[:n_test]
+
+
+def evaluate(model: IntentClassifier, examples: List[dict], threshold: float = CONFIDENCE_THRESHOLD) -> dict:
+    confusion = {c: {p: 0 for p in model.classes} for c in model.classes}
+    correct = confident = confident_correct = 0
+
+    start = time.perf_counter()
+    for e in examples:
+        pred, conf = model.predict(e["message"])
+        confusion[e["intent"]][pred] += 1
+        correct += pred == e["intent"]
+        if conf >= threshold:
+            confident += 1
+            confident_correct += pred == e["intent"]
+    elapsed = time.perf_counter() - start
+
+    n = len(examples) or 1
+    per_class = {}
+    for c in model.classes:
+        tp = confusion[c][c]
+        predicted = sum(confusion[t][c] for t in model.classes)
+        actual = sum(confusion[c].values())
+        per_class[c] = {
+            "precision": tp / predicted if predicted else 0.0,
+            "recall": tp / actual if actual else 0.0,
+            "support": actual,
+        }
+
+    return {
+        "n": len(examples),
+        "accuracy": correct / n,
+        "coverage": confident / n,  # part des messages qui n'iront pas au LLM
+        "accuracy_when_confident": confident_correct / confident if confident else 0.0,
+        "avg_latency_ms": elapsed * 1000 / n,
+        "per_class": per_class,
+        "confusion": confusion,
+    }
+
+
+def _print_report(report: dict) -> None:
+    print(f"Exemples : {report['n']}")
+    print(f"Précision globale : {report['accuracy']:.1%}")
+    print(f"Couverture (confiance >= {CONFIDENCE_THRESHOLD}) : {report['coverage']:.1%}"
+          f" — précision sur ces messages : {report['accuracy_when_confident']:.1%}")
+    print(f"Latence moyenne : {report['avg_latency_ms']:.3f} ms")
+    for c, m in report["per_class"].items():
+        print(f"  {c:<7} precision={m['precision']:.2f} recall={m['recall']:.2f} n={m['support']}")
+
+
+def _label_with_llm(path: str) -> None:
+    from mcp.model import ask_model_to_process
+
+    with open(path, encoding="utf-8") as f:
+        messages = [line.strip() for line in f if line.strip()]
+
+    labelled = 0
+    for msg in messages:
+        intent = ask_model_to_process(msg).get("intent")
+        if intent in INTENTS:
+            log_labelled_message(msg, intent, source="llm-batch", force=True)
+            labelled += 1
+        print(f"{intent or '?':<7} {msg}")
+    print(f"{labelled}/{len(messages)} messages étiquetés -> {LOG_PATH}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m mcp.intent", description="Classifieur d'intention local")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_train = sub.add_parser("train", help="entraîne et sauvegarde le modèle")
+    p_train.add_argument("--data", nargs="*", default=[SEED_PATH, LOG_PATH])
+    p_train.add_argument("--out", default=MODEL_PATH)
+    p_train.add_argument("--epochs", type=int, default=30)
+    p_train.add_argument("--holdout", type=float, default=0.2, help="part des exemples gardée pour l'évaluation")
+
+    p_eval = sub.add_parser("evaluate", help="évalue un modèle existant")
+    p_eval.add_argument("--data", nargs="*", default=[SEED_PATH, LOG_PATH])
+    p_eval.add_argument("--model", default=MODEL_PATH)
+
+    p_label = sub.add_parser("label", help="fait étiqueter un fichier de messages (1 par ligne) par le LLM")
+    p_label.add_argument("path")
+
+    p_pred = sub.add_parser("predict", help="prédit l'intention d'un message")
+    p_pred.add_argument("message")
+    p_pred.add_argument("--model", default=MODEL_PATH)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        examples = load_examples(args.data)
+        if not examples:
+            raise SystemExit("Aucun exemple d'entraînement trouvé.")
+        train, test = _split(examples, args.holdout)
+        if test:
+            print("== Évaluation sur le jeu de test ==")
+            _print_report(evaluate(IntentClassifier().fit(train, epochs=args.epochs), test))
+        # Le modèle sauvegardé est ré-entraîné sur toutes les données
+        model = IntentClassifier().fit(examples, epochs=args.epochs)
+        model.save(args.out)
+        print(f"Modèle entraîné sur {len(examples)} exemples -> {args.out}")
+
+    elif args.command == "evaluate":
+        _print_report(evaluate(IntentClassifier.load(args.model), load_examples(args.data)))
+
+    elif args.command == "label":
+        _label_with_llm(args.path)
+
+    elif args.command == "predict":
+        model = IntentClassifier.load(args.model)
+        intent, confidence = model.predict(args.message)
+        print(f"{intent} ({confidence:.2f})")
+        for c, p in sorted(model.predict_proba(args.message).items(), key=lambda kv: -kv[1]):
+            print(f"  {c:<7} {p:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,32 @@
 from __future__ import annotations
 
 import json
+import os
+import threading
 from datetime import datetime
 import locale
+from typing import Optional
 
+import httpx
 import ollama
 
+from mcp.deadline import Deadline, DeadlineExceeded, timeout_for
+from mcp.stages import stage
+
 MODEL_NAME = "llama3"
 
 
+def _parse_keep_alive(value: str):
+    # Ollama accepte une durée ("30m") ou un nombre de secondes (-1 = toujours en mémoire)
+    return int(value) if value.lstrip("-").isdigit() else value
+
+
+# Garde le modèle chargé entre deux messages (sinon déchargé après 5 min d'inactivité)
+KEEP_ALIVE = _parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE", "30m"))
+# Même num_ctx pour TOUS les appels : un num_ctx différent force Ollama à recharger le modèle
+NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "2048"))
+
+
 def _safe_set_french_locale() -> None:
     try:
         locale.setlocale(locale.LC_TIME, "fr_FR.UTF-8")
@@ -27,59 +45,218 @@ def get_current_date() -> str:
     return f"Aujourd'hui nous sommes le {now.strftime('%A %d %B %Y')}."
 
 
-def ask_model_to_process(message: str) -> dict:
+# ---------------------------
+# PROMPTS (préfixes stables)
+# ---------------------------
+# Les consignes longues sont dans le message system, identique d'un appel à l'autre :
+# Ollama réutilise alors le cache KV de ce préfixe. Seul le message user (date + phrase) varie.
+
+ROUTER_SYSTEM_PROMPT = (
+    "Tu es un assistant de voyage. Tu réponds UNIQUEMENT en JSON valide.\n"
+    "Analyse le message de l'utilisateur pour déterminer s'il veut (RECHERCHER un vol ou RÉSERVER un vol) "
+    "ou (RECHERCHER un hotel) ou (avoir des suggestions ou avoir une conversation).\n\n"
+    "CONSIGNES JSON STRICTES :\n"
+    "1) La clé 'intent' vaut soit 'search' soit 'book' soit 'advice' soit 'hotel'.\n"
+    "2) Si intent == 'search' : remplis originLocationCode, destinationLocationCode, departureDate, returnDate, legs, adults.\n"
+    "   - originLocationCode / destinationLocationCode : codes IATA (3 lettres majuscules)\n"
+    "   - departureDate : YYYY-MM-DD\n"
+    "   - returnDate : YYYY-MM-DD si l'utilisateur veut un aller-retour, sinon null\n"
+    "   - legs : si plusieurs étapes (ex: TLS puis LIS puis MAD), liste d'objets\n"
+    "     {originLocationCode, destinationLocationCode, departureDate} dans l'ordre, sinon null\n"
+    "   - adults : nombre (1 par défaut)\n"
+    "3) Si intent == 'book' : remplis flight_index, nom, prenom\n"
+    "   - flight_index : numéro du vol que l'utilisateur veut réserver (1 par défaut)\n"
+    "   - nom / prenom : si l'utilisateur les donne dans la phrase, sinon null\n"
+    "4) Si intent == 'advice' ou 'hotel' : uniquement la clé intent.\n"
+    "5) Les clés qui ne concernent pas l'intention valent null."
+)
+
+FLIGHT_SYSTEM_PROMPT = (
+    "Tu réponds uniquement en JSON valide.\n"
+    "Tu extrais des informations de vol avec ces clés :\n"
+    "originLocationCode, destinationLocationCode, departureDate, returnDate, legs, adults.\n"
+    "origin/destination = codes IATA (ex: TLS, CDG).\n"
+    "departureDate = YYYY-MM-DD.\n"
+    "returnDate = YYYY-MM-DD pour un aller-retour, sinon null.\n"
+    "legs = pour un voyage en plusieurs étapes, liste d'objets "
+    "{originLocationCode, destinationLocationCode, departureDate} dans l'ordre, sinon null.\n"
+    "adults = nombre (1 par défaut)."
+)
+
+HOTEL_SYSTEM_PROMPT = (
+    "Tu réponds uniquement en JSON valide.\n"
+    "Tu extrais des informations d’hôtel avec ces clés :\n"
+    "city_name, checkin, checkout, adults, rooms.\n"
+    "Dates = YYYY-MM-DD.\n"
+    "ATTENTION : si checkin/checkout ne sont pas présents dans la phrase, mets null.\n"
+    "adults = 2 par défaut, rooms = 1 par défaut."
+)
+
+BOOKING_SYSTEM_PROMPT = (
+    "Tu réponds uniquement en JSON valide.\n"
+    "Tu extrais des informations de réservation de vol avec ces clés :\n"
+    "flight_index, nom, prenom.\n"
+    "flight_index = numéro du vol choisi dans la liste (1 par défaut).\n"
+    "nom / prenom : si l'utilisateur les donne dans la phrase, sinon null."
+)
+
+
+# ---------------------------
+# SCHÉMAS JSON (format structuré Ollama)
+# ---------------------------
+
+_NULLABLE_STR = {"type": ["string", "null"]}
+_DATE = {"type": ["string", "null"], "pattern": "^[0-9]{4}-[0-9]{2}-[0-9]{2}$"}
+_IATA = {"type": ["string", "null"], "pattern": "^[A-Z]{3}$"}
+
+_LEGS = {
+    "type": ["array", "null"],
+    "items": {
+        "type": "object",
+        "properties": {"originLocationCode": _IATA, "destinationLocationCode": _IATA, "departureDate": _DATE},
+        "required": ["originLocationCode", "destinationLocationCode", "departureDate"],
+    },
+}
+
+_FLIGHT_PROPERTIES = {
+    "originLocationCode": _IATA,
+    "destinationLocationCode": _IATA,
+    "departureDate": _DATE,
+    "returnDate": _DATE,
+    "legs": _LEGS,
+    "adults": {"type": ["integer", "null"]},
+}
+
+_BOOKING_PROPERTIES = {
+    "flight_index": {"type": ["integer", "null"]},
+    "nom": _NULLABLE_STR,
+    "prenom": _NULLABLE_STR,
+}
+
+ROUTER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": ["search", "book", "advice", "hotel"]},
+        **_FLIGHT_PROPERTIES,
+        **_BOOKING_PROPERTIES,
+    },
+    "required": ["intent"],
+}
+
+FLIGHT_SCHEMA = {
+    "type": "object",
+    "properties": _FLIGHT_PROPERTIES,
+    "required": ["originLocationCode", "destinationLocationCode", "departureDate", "returnDate", "legs", "adults"],
+}
+
+HOTEL_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "city_name": _NULLABLE_STR,
+        "checkin": _DATE,
+        "checkout": _DATE,
+        "adults": {"type": ["integer", "null"]},
+        "rooms": {"type": ["integer", "null"]},
+    },
+    "required": ["city_name", "checkin", "checkout", "adults", "rooms"],
+}
+
+BOOKING_SCHEMA = {
+    "type": "object",
+    "properties": _BOOKING_PROPERTIES,
+    "required": ["flight_index", "nom", "prenom"],
+}
+
+# Nombre max de tokens générés par appel : une réponse JSON courte suffit
+ROUTER_NUM_PREDICT = 200
+FLIGHT_NUM_PREDICT = 200
+HOTEL_NUM_PREDICT = 80
+BOOKING_NUM_PREDICT = 60
+
+
+# ---------------------------
+# APPELS AU MODÈLE
+# ---------------------------
+
+_transport: Optional[httpx.HTTPTransport] = None
+_transport_lock = threading.Lock()
+
+
+def _client_with_timeout(timeout: float):
+    """
+    Client Ollama avec son propre timeout, mais branché sur un pool de connexions
+    partagé : pas de nouvelle connexion TCP à chaque appel. Le client n'est pas
+    fermé (ce qui fermerait le pool partagé), il ne possède aucune connexion.
+    """
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = httpx.HTTPTransport()
+    return ollama.Client(timeout=timeout, transport=_transport)
+
+
+def call_model(messages: list, deadline: Optional[Deadline] = None, **kwargs) -> dict:
+    """
+    Appel Ollama. Avec une deadline, on passe par un client dont le timeout
+    est le temps restant de la requête (pool de connexions partagé).
+    keep_alive et num_ctx sont communs à tous les appels pour garder le modèle
+    (et son cache de préfixe) en mémoire.
+    """
+    kwargs.setdefault("keep_alive", KEEP_ALIVE)
+    kwargs["options"] = {"num_ctx": NUM_CTX, **(kwargs.get("options") or {})}
+
+    client = ollama if deadline is None else _client_with_timeout(timeout_for(deadline))
+    try:
+        with stage("llm"):
+            return client.chat(model=MODEL_NAME, messages=messages, **kwargs)
+    except Exception as e:
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceeded("Budget épuisé pendant l'appel au modèle") from e
+        raise
+
+
+def _extract(system_prompt: str, schema: dict, num_predict: int, message: str,
+             deadline: Optional[Deadline] = None) -> dict:
+    """Extraction JSON contrainte par schéma : préfixe system stable, puis date + phrase."""
+    response = call_model(
+        [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"{get_current_date()}\nPhrase : {message}"},
+        ],
+        deadline,
+        format=schema,
+        options={"num_predict": num_predict, "temperature": 0},
+    )
+    return json.loads(response["message"]["content"])
+
+
+def ask_model_to_process(message: str, deadline: Optional[Deadline] = None) -> dict:
     """
     Détermine l'intention de l'utilisateur:
     - intent = 'search' (recherche de vol) + extraction des champs vol
     - intent = 'book' (réservation)
     """
-    current_date = get_current_date()
-
-    prompt = (
-        f"{current_date}\n"
-        "Analyse le message de l'utilisateur pour déterminer s'il veut (RECHERCHER un vol ou RÉSERVER un vol) ou (RECHERCHER un hotel) ou (avoir des suggestions ou avoir une conversation).\n\n"
-        "CONSIGNES JSON STRICTES :\n"
-        "1) Ajoute une clé 'intent' qui vaut soit 'search' soit 'book' soit 'advice' soit 'hotel'.\n"
-        "2) Si intent == 'search' : réponds en JSON à plat avec UNIQUEMENT ces clés :\n"
-        "   intent, originLocationCode, destinationLocationCode, departureDate, adults.\n"
-        "   - originLocationCode / destinationLocationCode : codes IATA (3 lettres majuscules)\n"
-        "   - departureDate : YYYY-MM-DD\n"
-        "   - adults : nombre (1 par défaut)\n"
-        "3) Si intent == 'book' : réponds en JSON à plat avec UNIQUEMENT ces clés :\n"
-        "   intent, flight_index, nom, prenom\n"
-        "   - flight_index : numéro du vol que l'utilisateur veut réserver (1 par défaut)\n"
-        "   - nom / prenom : si l'utilisateur les donne dans la phrase, sinon null\n"
-        "4) si intent == 'advice' : réponds en JSON à plat avec UNIQUEMENT la clé: intent\n"
-        "5) si intent == 'hotel' : réponds en JSON à plat avec UNIQUEMENT la clés : intent\n"
- 
-        "6) Important, Tu réponds UNIQUEMENT en format JSON valide.\n"
-        f"Phrase : {message}"
-    )
-
     try:
-        response = ollama.chat(
-            model=MODEL_NAME,
-            format="json",
-            messages=[
-                {"role": "system", "content": "Tu es un assistant de voyage. Tu réponds UNIQUEMENT en JSON valide."},
-                {"role": "user", "content": prompt},
-            ],
-        )
-        return json.loads(response["message"]["content"])
+        data = _extract(ROUTER_SYSTEM_PROMPT, ROUTER_SCHEMA, ROUTER_NUM_PREDICT, message, deadline)
+        # Les clés laissées à null ne concernent pas l'intention : on les retire
+        return {k: v for k, v in data.items() if v is not None}
     except Exception as e:
         print(f"Erreur IA (process) : {e}")
         return {}
 
 
-def process_user_message(message: str) -> dict:
+def process_user_message(message: str, deadline: Optional[Deadline] = None) -> dict:
     """
     Utilisé par le controller 'session' pour gérer 'search' vs 'book'.
     """
-    data = ask_model_to_process(message)
+    data = ask_model_to_process(message, deadline)
     intent = data.get("intent")
 
     if intent == "search":
-        if not data.get("originLocationCode") or not data.get("destinationLocationCode") or not data.get("departureDate"):
+        if not data.get("legs") and (
+            not data.get("originLocationCode") or not data.get("destinationLocationCode") or not data.get("departureDate")
+        ):
             return {"intent": "error", "message": "Détails de recherche manquants (départ/destination/date)."}
         if "adults" not in data or data["adults"] in (None, ""):
             data["adults"] = 1
@@ -94,27 +271,14 @@ def process_user_message(message: str) -> dict:
     return {"intent": "unknown", "message": "Je n'ai pas compris si vous voulez chercher ou réserver."}
 
 
-def extract_flight_query(message: str) -> dict:
-    prompt = (
-        "Tu extrais des informations de vol.\n"
-        "Réponds UNIQUEMENT en JSON à plat avec ces clés :\n"
-        "originLocationCode, destinationLocationCode, departureDate, adults.\n"
-        "origin/destination = codes IATA (ex: TLS, CDG).\n"
-        "departureDate = YYYY-MM-DD.\n"
-        "adults = nombre (1 par défaut).\n\n"
-        f"Phrase : {message}"
-    )
-
-    response = ollama.chat(
-        model=MODEL_NAME,
-        format="json",
-        messages=[
-            {"role": "system", "content": "Tu réponds uniquement en JSON valide."},
-            {"role": "user", "content": prompt},
-        ],
-    )
+def extract_flight_query(message: str, deadline: Optional[Deadline] = None) -> dict:
+    data = _extract(FLIGHT_SYSTEM_PROMPT, FLIGHT_SCHEMA, FLIGHT_NUM_PREDICT, message, deadline)
 
-    data = json.loads(response["message"]["content"])
+    legs = data.get("legs") if isinstance(data.get("legs"), list) else []
+    if len(legs) >= 2 and isinstance(legs[0], dict):
+        # Multi-destinations : le 1er trajet sert de départ/destination/date "principaux"
+        for key in ("originLocationCode", "destinationLocationCode", "departureDate"):
+            data[key] = data.get(key) or legs[0].get(key)
 
     if not data.get("originLocationCode") or not data.get("destinationLocationCode") or not data.get("departureDate"):
         raise ValueError("Impossible d’extraire départ/destination/date pour le vol.")
@@ -123,34 +287,17 @@ def extract_flight_query(message: str) -> dict:
         "originLocationCode": data["originLocationCode"],
         "destinationLocationCode": data["destinationLocationCode"],
         "departureDate": data["departureDate"],
-        "adults": int(data.get("adults", 1)),
+        "returnDate": data.get("returnDate") or None,
+        "legs": legs,
+        "adults": int(data.get("adults") or 1),
     }
 
 
-def extract_hotel_query(message: str) -> dict:
-    prompt = (
-        "Tu extrais des informations d’hôtel.\n"
-        "Réponds UNIQUEMENT en JSON à plat avec ces clés :\n"
-        "city_name, checkin, checkout, adults, rooms.\n"
-        "Dates = YYYY-MM-DD.\n"
-        "ATTENTION : si checkin/checkout ne sont pas présents dans la phrase, mets null.\n"
-        "adults = 2 par défaut, rooms = 1 par défaut.\n\n"
-        f"Phrase : {message}"
-    )
-
-    response = ollama.chat(
-        model=MODEL_NAME,
-        format="json",
-        messages=[
-            {"role": "system", "content": "Tu réponds uniquement en JSON valide."},
-            {"role": "user", "content": prompt},
-        ],
-    )
-
-    data = json.loads(response["message"]["content"])
+def extract_hotel_query(message: str, deadline: Optional[Deadline] = None) -> dict:
+    data = _extract(HOTEL_SYSTEM_PROMPT, HOTEL_SCHEMA, HOTEL_NUM_PREDICT, message, deadline)
 
-    adults = data.get("adults", 2)
-    rooms = data.get("rooms", 1)
+    adults = data.get("adults") or 2
+    rooms = data.get("rooms") or 1
 
     city_name = data.get("city_name")
     checkin = data.get("checkin")
@@ -168,3 +315,21 @@ def extract_hotel_query(message: str) -> dict:
         "adults": int(adults),
         "rooms": int(rooms),
     }
+
+
+def extract_booking_query(message: str, deadline: Optional[Deadline] = None) -> dict:
+    """
+    Slots de réservation quand l'intention 'book' vient du classifieur local
+    (le LLM de routage n'a alors pas été appelé).
+    """
+    data = _extract(BOOKING_SYSTEM_PROMPT, BOOKING_SCHEMA, BOOKING_NUM_PREDICT, message, deadline)
+
+    flight_index = data.get("flight_index")
+    if flight_index in (None, ""):
+        flight_index = 1
+
+    return {
+        "flight_index": flight_index,
+        "nom": data.get("nom"),
+        "prenom": data.get("prenom"),
+    }
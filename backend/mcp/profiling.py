@@ -0,0 +1,298 @@
+"""
+Capture des tours /chat lents en production (opt-in, PROFILING=1).
+
+- chaque tour est enregistré au début (quelques opérations, aucun échantillonnage)
+- un thread échantillonneur relève les piles (sys._current_frames) des threads
+  du tour, seulement une fois que le tour dépasse PROFILE_SAMPLE_AFTER_MS
+- à la fin, un tour plus long que PROFILE_SLOW_MS entre dans le classement des
+  PROFILE_KEEP tours les plus lents : durée, étapes (mcp/stages.py), intention,
+  message et état de session anonymisés, erreur éventuelle, piles échantillonnées
+- main.py expose ce classement (JSON) et les piles au format "collapsed"
+  (flamegraph.pl, speedscope, inferno...)
+
+Sans PROFILING=1 : pas de thread, begin() renvoie None et le reste ne fait rien.
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from mcp.session import sessions
+
+PROFILING_ENABLED = os.getenv("PROFILING", "0") == "1"
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "3000"))
+# L'échantillonnage démarre avant le seuil pour couvrir la partie lente du tour
+PROFILE_SAMPLE_AFTER_MS = float(os.getenv("PROFILE_SAMPLE_AFTER_MS", str(PROFILE_SLOW_MS / 2)))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+
+MAX_STACK_DEPTH = 64
+MAX_STACKS_PER_TURN = 2000
+MAX_MESSAGE_CHARS = 200
+
+
+class Turn:
+    def __init__(self, endpoint: str, message: str, session_id: Optional[str]):
+        self.id = next(_ids)
+        self.endpoint = endpoint
+        self.at = datetime.now().isoformat(timespec="seconds")
+        self.start = time.perf_counter()
+        self.message = sanitize(message)
+        self.session = session_snapshot(session_id)
+        self.info: Dict[str, Any] = {}
+        self.threads: Counter = Counter()  # thread id -> profondeur d'attachement
+        self.stacks: Counter = Counter()  # pile "a;b;c" -> nb d'échantillons
+        self.samples = 0
+
+
+_ids = itertools.count(1)
+_current: ContextVar[Optional[Turn]] = ContextVar("profiled_turn", default=None)
+_active: Dict[int, Turn] = {}
+_slowest: List[tuple] = []  # tas min (durée, id, enregistrement)
+_lock = threading.Lock()
+_sampler: Optional[threading.Thread] = None
+
+
+# ---------------------------
+# ANONYMISATION
+# ---------------------------
+
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+# Longues suites de chiffres (téléphone, carte...) ; les dates AAAA-MM-JJ sont gardées
+DIGITS_RE = re.compile(r"(?<![\d-])\+?\d[\d .]{5,}\d(?![\d-])")
+# Nom / prénom après "pour", "au nom de", "je m'appelle", "nom :", "prénom :"
+NAME_RE = re.compile(
+    r"(\b(?:pour|au nom de|je m'appelle|je suis|nom\s*:|pr[ée]nom\s*:)\s+)"
+    r"((?:[A-ZÀ-Ü][\w'-]+\s*){1,3})"
+)
+
+
+def sanitize(text: Any) -> str:
+    text = str(text or "")
+    text = EMAIL_RE.sub("<email>", text)
+    text = DIGITS_RE.sub("<numéro>", text)
+    text = NAME_RE.sub(lambda m: m.group(1) + "<nom>" + (" " if m.group(2)[-1].isspace() else ""), text)
+    if len(text) > MAX_MESSAGE_CHARS:
+        text = text[:MAX_MESSAGE_CHARS] + "…"
+    return text
+
+
+def _summarize(value: Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return f"<{len(value)} éléments>"
+    if isinstance(value, dict):
+        return {k: _summarize(v) for k, v in value.items() if k not in ("nom", "prenom")}
+    if isinstance(value, str):
+        return sanitize(value)
+    return value
+
+
+def session_snapshot(session_id: Optional[str]) -> Optional[dict]:
+    """État de session au début du tour : scalaires anonymisés, listes réduites à leur taille."""
+    session = sessions.get(session_id) if session_id else None
+    if session is None:
+        return None
+    return {key: _summarize(value) for key, value in dict(session).items()}
+
+
+# ---------------------------
+# SUIVI DES TOURS
+# ---------------------------
+
+def begin(endpoint: str, message: str, session_id: Optional[str] = None) -> Optional[Turn]:
+    if not PROFILING_ENABLED:
+        return None
+    _ensure_sampler()
+    turn = Turn(endpoint, message, session_id)
+    with _lock:
+        _active[turn.id] = turn
+    return turn
+
+
+@contextmanager
+def running(turn: Optional[Turn]) -> Iterator[None]:
+    """Le thread courant travaille pour ce tour (à ouvrir à chaque reprise d'un tour en streaming)."""
+    if turn is None:
+        yield
+        return
+
+    token = _current.set(turn)
+    tid = threading.get_ident()
+    with _lock:
+        turn.threads[tid] += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            turn.threads[tid] -= 1
+            if turn.threads[tid] <= 0:
+                del turn.threads[tid]
+        _current.reset(token)
+
+
+def follow(fn, *args, **kwargs):
+    """Exécute fn dans un thread de pool en l'attachant au tour courant (voir stages.submit)."""
+    turn = _current.get()
+    if turn is None:
+        return fn(*args, **kwargs)
+    with running(turn):
+        return fn(*args, **kwargs)
+
+
+def annotate(**fields: Any) -> None:
+    """Ajoute des informations (intention...) au tour courant, s'il est suivi."""
+    turn = _current.get()
+    if turn is not None:
+        turn.info.update(fields)
+
+
+def end(turn: Optional[Turn], timings: Optional[Dict[str, float]] = None, error: Optional[BaseException] = None) -> None:
+    if turn is None:
+        return
+
+    duration = time.perf_counter() - turn.start
+    with _lock:
+        _active.pop(turn.id, None)
+        stacks, samples = Counter(turn.stacks), turn.samples
+    if duration * 1000 < PROFILE_SLOW_MS:
+        return
+
+    record = {
+        "id": turn.id,
+        "at": turn.at,
+        "endpoint": turn.endpoint,
+        "duration_ms": round(duration * 1000, 1),
+        "stages_ms": {name: round(elapsed * 1000, 1) for name, elapsed in sorted((timings or {}).items())},
+        **turn.info,
+        "message": turn.message,
+        "session": turn.session,
+        "error": sanitize(f"{type(error).__name__}: {error}") if error is not None else None,
+        "samples": samples,
+        "stacks": stacks,
+    }
+    with _lock:
+        item = (duration, turn.id, record)
+        if len(_slowest) < PROFILE_KEEP:
+            heapq.heappush(_slowest, item)
+        elif duration > _slowest[0][0]:
+            heapq.heapreplace(_slowest, item)
+
+
+# ---------------------------
+# ÉCHANTILLONNAGE
+# ---------------------------
+
+def _frame_label(code) -> str:
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{os.path.basename(code.co_filename)}:{name}".replace(";", ",").replace(" ", "_")
+
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def _sample_once() -> None:
+    now = time.perf_counter()
+    with _lock:
+        due = [
+            (turn, list(turn.threads))
+            for turn in _active.values()
+            if (now - turn.start) * 1000 >= PROFILE_SAMPLE_AFTER_MS
+        ]
+    if not due:
+        return
+
+    frames = sys._current_frames()
+    collected = [
+        (turn, [_collapse(frames[tid]) for tid in thread_ids if tid in frames])
+        for turn, thread_ids in due
+    ]
+    del frames
+
+    with _lock:
+        for turn, stacks in collected:
+            turn.samples += 1
+            for stack in stacks:
+                if stack in turn.stacks or len(turn.stacks) < MAX_STACKS_PER_TURN:
+                    turn.stacks[stack] += 1
+
+
+def _loop() -> None:
+    interval = PROFILE_INTERVAL_MS / 1000
+    while True:
+        time.sleep(interval)
+        try:
+            _sample_once()
+        except Exception as e:
+            print(f"Erreur échantillonnage : {e}")
+
+
+def _ensure_sampler() -> None:
+    global _sampler
+    if _sampler is not None:
+        return
+    with _lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_loop, name="turn-profiler", daemon=True)
+            _sampler.start()
+
+
+# ---------------------------
+# EXPORT
+# ---------------------------
+
+def slow_turns() -> List[dict]:
+    """Tours les plus lents, du plus lent au plus rapide (sans les piles)."""
+    with _lock:
+        records = [record for _, _, record in sorted(_slowest, reverse=True)]
+    return [{k: v for k, v in record.items() if k != "stacks"} for record in records]
+
+
+def collapsed_stacks(turn_id: Optional[int] = None) -> str:
+    """
+    Piles au format "collapsed" (une ligne "cadre;cadre;... nb" par pile), à passer à
+    flamegraph.pl ou à ouvrir dans speedscope. Chaque pile est préfixée par le tour
+    et son intention pour pouvoir comparer les tours entre eux.
+    """
+    with _lock:
+        records = [record for _, _, record in sorted(_slowest, reverse=True)]
+    lines = []
+    for record in records:
+        if turn_id is not None and record["id"] != turn_id:
+            continue
+        root = f"tour_{record['id']}_{record.get('intent') or 'inconnu'}_{record['duration_ms']:.0f}ms"
+        for stack, count in record["stacks"].most_common():
+            lines.append(f"{root};{stack} {count}")
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+def clear() -> None:
+    with _lock:
+        _slowest.clear()
+
+
+def stats() -> dict:
+    with _lock:
+        return {
+            "enabled": PROFILING_ENABLED,
+            "slow_ms": PROFILE_SLOW_MS,
+            "sample_after_ms": PROFILE_SAMPLE_AFTER_MS,
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "keep": PROFILE_KEEP,
+            "active_turns": len(_active),
+            "captured": len(_slowest),
+        }
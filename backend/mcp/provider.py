@@ -1,9 +1,22 @@
 from __future__ import annotations
 
 import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeout
+from typing import Iterator, Optional
+
 import requests
 from dotenv import load_dotenv
 
+from mcp import cache
+from mcp.deadline import Deadline, DeadlineExceeded, timeout_for
+from mcp.stages import stage, submit
+
 load_dotenv()
 
 # CONFIG
@@ -17,57 +30,279 @@ CITY_SEARCH_URL = "https://test.api.amadeus.com/v1/reference-data/locations"
 HOTEL_LIST_URL = "https://test.api.amadeus.com/v1/reference-data/locations/hotels/by-city"
 HOTEL_OFFERS_URL = "https://test.api.amadeus.com/v3/shopping/hotel-offers"
 
+# Timeouts max par étape (réduits au temps restant si une deadline est fournie)
+TOKEN_TIMEOUT_S = 15
+CITY_TIMEOUT_S = 15
+HOTEL_LIST_TIMEOUT_S = 20
+FLIGHTS_TIMEOUT_S = 20
+HOTEL_OFFERS_TIMEOUT_S = 30
+
+# Taille des lots d'hôtels pour hotel-offers (lots demandés en parallèle)
+HOTEL_OFFERS_BATCH_SIZE = int(os.getenv("HOTEL_OFFERS_BATCH_SIZE", "4"))
+# Code d'erreur Amadeus renvoyé en 400 quand aucun hôtel du lot n'a de chambre
+NO_ROOMS_AVAILABLE_CODE = "3664"
+
+# HEDGING : si un GET (idempotent) dépasse le percentile de latence observé,
+# on relance une 2e requête identique (dans le pool, seulement s'il a un thread libre).
+HEDGE_ENABLED = os.getenv("AMADEUS_HEDGE", "1") == "1"
+HEDGE_PERCENTILE = float(os.getenv("AMADEUS_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("AMADEUS_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_POOL_SIZE = 8
+# Quand une relance est possible, la 1re requête est abandonnée au-delà de N fois le seuil
+HEDGE_PRIMARY_TIMEOUT_FACTOR = 4
+
+_latencies: dict = defaultdict(lambda: deque(maxlen=200))
+_latencies_lock = threading.Lock()
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE, thread_name_prefix="amadeus-hedge")
+# Un slot par relance possible : une relance n'attend jamais dans la file du pool
+_hedge_slots = threading.BoundedSemaphore(HEDGE_POOL_SIZE)
+# Pool séparé pour les appels lancés en parallèle (étapes multi-destinations, lots d'offres
+# d'hôtels) : eux-mêmes peuvent utiliser le pool de hedging
+_fanout_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="amadeus-fanout")
+
+# Compteurs d'appels HTTP Amadeus (quota) par origine ("user" ou "warm", voir calls_from)
+# et recherches utilisateur en cours (pour le warmer)
+_api_calls: Counter = Counter()
+_call_source: ContextVar[str] = ContextVar("amadeus_call_source", default="user")
+_user_searches_in_flight = 0
+_counters_lock = threading.Lock()
+
+# Le token OAuth est valable ~30 min : on le réutilise au lieu d'en redemander un à chaque recherche
+_token: Optional[str] = None
+_token_expires_at = 0.0
+_token_lock = threading.Lock()
+
+
+def _count_api_call() -> None:
+    with _counters_lock:
+        _api_calls[_call_source.get()] += 1
+
+
+def api_call_count(source: Optional[str] = None) -> int:
+    """Appels Amadeus faits depuis le démarrage, tous ou d'une seule origine."""
+    with _counters_lock:
+        return _api_calls[source] if source else sum(_api_calls.values())
+
+
+@contextmanager
+def calls_from(source: str) -> Iterator[None]:
+    """Attribue les appels Amadeus faits dans ce bloc (et ses threads de pool) à `source`."""
+    token = _call_source.set(source)
+    try:
+        yield
+    finally:
+        _call_source.reset(token)
+
+
+def user_searches_in_flight() -> int:
+    return _user_searches_in_flight
+
+
+def _track_user_search(delta: int) -> None:
+    global _user_searches_in_flight
+    with _counters_lock:
+        _user_searches_in_flight += delta
+
+
+def _record_latency(url: str, elapsed: float) -> None:
+    with _latencies_lock:
+        _latencies[url].append(elapsed)
+
+
+def _hedge_threshold(url: str) -> Optional[float]:
+    """Latence au percentile HEDGE_PERCENTILE pour cette URL (None si pas assez d'historique)."""
+    with _latencies_lock:
+        samples = sorted(_latencies[url])
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    idx = min(int(len(samples) * HEDGE_PERCENTILE / 100), len(samples) - 1)
+    return samples[idx]
+
+
+def _do_get(url: str, headers: dict, params: dict, timeout: Optional[float]) -> dict:
+    start = time.monotonic()
+    _count_api_call()
+    with stage("amadeus"):
+        r = requests.get(url, headers=headers, params=params, timeout=timeout)
+        r.raise_for_status()
+        data = r.json()
+    _record_latency(url, time.monotonic() - start)
+    return data
+
+
+def _hedged_get(url: str, headers: dict, params: dict, timeout: Optional[float],
+                threshold: float, deadline: Optional[Deadline]) -> dict:
+    """
+    La 1re requête part sur le thread appelant ; la relance part dans le pool si la
+    1re n'a pas répondu après `threshold` secondes. Le thread appelant ne peut pas
+    être interrompu pendant requests.get : on borne donc sa 1re requête à
+    HEDGE_PRIMARY_TIMEOUT_FACTOR x threshold, puis on attend la relance.
+    Un slot du pool est réservé dès le départ : sans slot libre, pas de hedging.
+    """
+    if not _hedge_slots.acquire(blocking=False):
+        return _do_get(url, headers, params, timeout)
+
+    backup = []
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def _backup() -> dict:
+        try:
+            return _do_get(url, headers, params, timeout_for(deadline, timeout))
+        finally:
+            _hedge_slots.release()
+
+    def _launch() -> None:
+        with lock:
+            if done.is_set():
+                return
+            try:
+                backup.append(submit(_hedge_pool, _backup))
+            except DeadlineExceeded:
+                pass
+
+    timer = threading.Timer(threshold, copy_context().run, args=(_launch,))
+    timer.daemon = True
+    timer.start()
+    try:
+        primary_timeout = min(timeout, threshold * HEDGE_PRIMARY_TIMEOUT_FACTOR) if timeout else timeout
+        return _do_get(url, headers, params, primary_timeout)
+    except (requests.Timeout, requests.ConnectionError) as primary_error:
+        with lock:
+            done.set()
+        if not backup:
+            raise
+        try:
+            return backup[0].result(timeout=timeout_for(deadline, timeout))
+        except FuturesTimeout:
+            raise DeadlineExceeded(f"Pas de réponse à temps de {url}") from primary_error
+        except Exception:
+            raise primary_error
+    finally:
+        with lock:
+            done.set()
+        timer.cancel()
+        if not backup:
+            _hedge_slots.release()
+
+
+def _get(url: str, token: str, params: dict, cap: float,
+         deadline: Optional[Deadline] = None, hedge: bool = False) -> dict:
+    """GET Amadeus avec timeout borné par la deadline (et hedging optionnel)."""
+    timeout = timeout_for(deadline, cap)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    try:
+        threshold = _hedge_threshold(url) if (hedge and HEDGE_ENABLED) else None
+        if threshold is not None and threshold < timeout:
+            return _hedged_get(url, headers, params, timeout, threshold, deadline)
+        return _do_get(url, headers, params, timeout)
+    except requests.Timeout as e:
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceeded(f"Budget épuisé pendant l'appel à {url}") from e
+        raise
+
 
 # AUTH
-def get_token() -> str:
+def get_token(deadline: Optional[Deadline] = None) -> str:
+    global _token, _token_expires_at
+
     if not CLIENT_ID or not CLIENT_SECRET:
         raise RuntimeError("AMADEUS_CLIENT_ID / AMADEUS_CLIENT_SECRET manquants dans le .env")
 
-    r = requests.post(
-        TOKEN_URL,
-        data={
-            "grant_type": "client_credentials",
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
-        },
-        headers={"Content-Type": "application/x-www-form-urlencoded"},
-        timeout=15,
-    )
+    with _token_lock:
+        if _token and time.monotonic() < _token_expires_at:
+            return _token
+
+    _count_api_call()
+    try:
+        with stage("amadeus"):
+            r = requests.post(
+                TOKEN_URL,
+                data={
+                    "grant_type": "client_credentials",
+                    "client_id": CLIENT_ID,
+                    "client_secret": CLIENT_SECRET,
+                },
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+                timeout=timeout_for(deadline, TOKEN_TIMEOUT_S),
+            )
+    except requests.Timeout as e:
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceeded("Budget épuisé pendant l'authentification Amadeus") from e
+        raise
     r.raise_for_status()
-    return r.json()["access_token"]
+    payload = r.json()
+
+    with _token_lock:
+        _token = payload["access_token"]
+        # marge de 60 s pour ne jamais envoyer un token sur le point d'expirer
+        _token_expires_at = time.monotonic() + max(float(payload.get("expires_in", 0)) - 60, 0)
+    return _token
+
+
+def _cached_search(kind: str, fetch, query: dict, deadline: Optional[Deadline]) -> list[dict]:
+    cache.record_search(kind, query)
+    cached = cache.get(kind, query)
+    if cached is not None:
+        return cached
+
+    _track_user_search(1)
+    try:
+        data = fetch(query, deadline)
+    finally:
+        _track_user_search(-1)
+
+    if is_complete(kind, data):
+        cache.put(kind, query, data, source="user")
+    return data
+
+
+def is_complete(kind: str, data: list[dict]) -> bool:
+    """Une réponse partielle (hôtels sans offres, budget épuisé) ne doit pas être mise en cache."""
+    if kind == "hotels":
+        return all(item.get("offers") for item in data)
+    return True
 
 
 # FLIGHTS
-def search_flights(query: dict) -> list[dict]:
-    token = get_token()
-
-    r = requests.get(
-        FLIGHTS_URL,
-        headers={"Authorization": f"Bearer {token}"},
-        params=query,
-        timeout=20,
-    )
-    r.raise_for_status()
-    return r.json().get("data", [])
+def fetch_flights(query: dict, deadline: Optional[Deadline] = None) -> list[dict]:
+    token = get_token(deadline)
+
+    data = _get(FLIGHTS_URL, token, query, FLIGHTS_TIMEOUT_S, deadline, hedge=True)
+    return data.get("data", [])
+
+
+def search_flights(query: dict, deadline: Optional[Deadline] = None) -> list[dict]:
+    return _cached_search("flights", fetch_flights, query, deadline)
+
+
+def iter_multi_city(queries: list[dict], deadline: Optional[Deadline] = None) -> Iterator[tuple[int, list[dict]]]:
+    """Un aller simple par étape, récupérés en parallèle : (index de l'étape, vols) dans l'ordre d'arrivée."""
+    futures = {submit(_fanout_pool, search_flights, q, deadline): i for i, q in enumerate(queries)}
+    for f in as_completed(futures):
+        yield futures[f], f.result()
+
+
+def search_multi_city(queries: list[dict], deadline: Optional[Deadline] = None) -> list[list[dict]]:
+    """Comme iter_multi_city, résultats dans l'ordre des étapes."""
+    results: list[list[dict]] = [[] for _ in queries]
+    for i, flights in iter_multi_city(queries, deadline):
+        results[i] = flights
+    return results
 
 
 # HOTELS
-def city_name_to_city_code(city_name: str) -> str:
-    token = get_token()
+def city_name_to_city_code(city_name: str, deadline: Optional[Deadline] = None, token: Optional[str] = None) -> str:
+    token = token or get_token(deadline)
 
     name = (city_name or "").strip()
     if not name:
         raise ValueError("city_name vide")
 
-    r = requests.get(
-        CITY_SEARCH_URL,
-        headers={"Authorization": f"Bearer {token}"},
-        params={"subType": "CITY", "keyword": name},
-        timeout=15,
-    )
-    r.raise_for_status()
-
-    data = r.json().get("data", [])
+    data = _get(
+        CITY_SEARCH_URL, token, {"subType": "CITY", "keyword": name}, CITY_TIMEOUT_S, deadline, hedge=True
+    ).get("data", [])
     if not data:
         raise ValueError(f"Ville inconnue : {city_name}")
 
@@ -78,46 +313,116 @@ def city_name_to_city_code(city_name: str) -> str:
     return iata
 
 
-def search_hotels(query: dict) -> list[dict]:
+def search_hotels(query: dict, deadline: Optional[Deadline] = None) -> list[dict]:
+    return [item for batch in stream_hotels(query, deadline) for item in batch]
+
+
+def stream_hotels(query: dict, deadline: Optional[Deadline] = None) -> Iterator[list[dict]]:
+    """Comme search_hotels, mais lot par lot (cache consulté d'abord, rempli à la fin)."""
+    cache.record_search("hotels", query)
+    cached = cache.get("hotels", query)
+    if cached is not None:
+        yield cached
+        return
+
+    data: list[dict] = []
+    _track_user_search(1)
+    try:
+        for batch in iter_hotel_offers(query, deadline):
+            data.extend(batch)
+            yield batch
+    finally:
+        _track_user_search(-1)
+
+    if is_complete("hotels", data):
+        cache.put("hotels", query, data, source="user")
+
+
+def fetch_hotels(query: dict, deadline: Optional[Deadline] = None) -> list[dict]:
+    """Recherche d'hôtels sans cache (utilisée par le warmer)."""
+    return [item for batch in iter_hotel_offers(query, deadline) for item in batch]
+
+
+def _no_rooms_available(e: requests.HTTPError) -> bool:
+    """400 avec le code Amadeus NO ROOMS AVAILABLE : pas une erreur, juste aucune offre."""
+    if e.response is None or e.response.status_code != 400:
+        return False
+    try:
+        errors = e.response.json().get("errors", [])
+    except ValueError:
+        return False
+    return any(str(err.get("code")) == NO_ROOMS_AVAILABLE_CODE for err in errors)
+
+
+def iter_hotel_offers(query: dict, deadline: Optional[Deadline] = None) -> Iterator[list[dict]]:
     """
-    Retourne la structure brute de Amadeus v3/hotel-offers (data list).
+    Produit la structure brute de Amadeus v3/hotel-offers (data list), lot par lot.
+    Les offres sont demandées par lots de HOTEL_OFFERS_BATCH_SIZE hôtels en parallèle,
+    chaque lot est renvoyé dès qu'il arrive.
     Le controller s'occupe de:
     - choisir l'offre la moins chère
     - trier
     - formater proprement
+    Si le budget temps est épuisé avant certaines offres, ou si un lot échoue, on renvoie
+    ces hôtels sans offres (réponse partielle) plutôt que rien. Un lot refusé pour
+    absence de disponibilité (code Amadeus 3664) est simplement vide.
     """
-    token = get_token()
+    token = get_token(deadline)
 
-    city_code = city_name_to_city_code(query["city_name"])
+    city_code = city_name_to_city_code(query["city_name"], deadline, token=token)
 
     # 1) Liste des hôtels (IDs) via by-city
-    r1 = requests.get(
-        HOTEL_LIST_URL,
-        headers={"Authorization": f"Bearer {token}"},
-        params={"cityCode": city_code},
-        timeout=20,
-    )
-    r1.raise_for_status()
-
-    hotels = r1.json().get("data", [])[:10]
-    hotel_ids = [h.get("hotelId") for h in hotels if h.get("hotelId")]
-
-    if not hotel_ids:
-        return []
-
-    # 2) Offres/prix via v3 hotel-offers
-    r2 = requests.get(
-        HOTEL_OFFERS_URL,
-        headers={"Authorization": f"Bearer {token}"},
-        params={
-            "hotelIds": ",".join(hotel_ids),
-            "checkInDate": query["checkin"],
-            "checkOutDate": query["checkout"],
-            "adults": int(query.get("adults", 2)),
-            "roomQuantity": int(query.get("rooms", 1)),
-        },
-        timeout=30,
-    )
-    r2.raise_for_status()
-
-    return r2.json().get("data", [])
+    hotels = _get(
+        HOTEL_LIST_URL, token, {"cityCode": city_code}, HOTEL_LIST_TIMEOUT_S, deadline, hedge=True
+    ).get("data", [])[:10]
+    hotels = [h for h in hotels if h.get("hotelId")]
+
+    if not hotels:
+        return
+
+    # 2) Offres/prix via v3 hotel-offers, par lots en parallèle
+    batches = [hotels[i:i + HOTEL_OFFERS_BATCH_SIZE] for i in range(0, len(hotels), HOTEL_OFFERS_BATCH_SIZE)]
+    futures = {
+        submit(
+            _fanout_pool,
+            _get,
+            HOTEL_OFFERS_URL,
+            token,
+            {
+                "hotelIds": ",".join(h["hotelId"] for h in batch),
+                "checkInDate": query["checkin"],
+                "checkOutDate": query["checkout"],
+                "adults": int(query.get("adults", 2)),
+                "roomQuantity": int(query.get("rooms", 1)),
+            },
+            HOTEL_OFFERS_TIMEOUT_S,
+            deadline,
+            True,
+        ): batch
+        for batch in batches
+    }
+
+    missing: list[dict] = []
+    handled = set()
+    try:
+        for f in as_completed(futures, timeout=timeout_for(deadline)):
+            handled.add(f)
+            try:
+                yield f.result().get("data", [])
+            except DeadlineExceeded:
+                missing.extend(futures[f])
+            except requests.HTTPError as e:
+                # Aucune chambre dispo pour les hôtels du lot -> lot vide, les autres lots restent valables
+                if _no_rooms_available(e):
+                    continue
+                print(f"Erreur hotel-offers (lot {','.join(h['hotelId'] for h in futures[f])}) : {e}")
+                missing.extend(futures[f])
+            except requests.RequestException as e:
+                print(f"Erreur hotel-offers (lot {','.join(h['hotelId'] for h in futures[f])}) : {e}")
+                missing.extend(futures[f])
+    except (FuturesTimeout, DeadlineExceeded):
+        # Y compris les lots terminés après l'abandon de as_completed mais jamais renvoyés
+        missing.extend(h for f, batch in futures.items() if f not in handled for h in batch)
+
+    if missing:
+        yield [{"hotel": {**h, "cityCode": city_code}} for h in missing]
@@ -1,7 +1,6 @@
-import ollama
-from mcp.model import MODEL_NAME
+from mcp.model import call_model
 
-def get_activity_suggestions(message: str, session_id: str = None):
+def get_activity_suggestions(message: str, session_id: str = None, deadline=None):
     """Génère des suggestions touristiques via Llama 3."""
     system_prompt = (
         "Tu es Wingman, un guide de voyage expert. L'utilisateur te demande des conseils, "
@@ -11,12 +10,13 @@ def get_activity_suggestions(message: str, session_id: str = None):
         
     )
     try:
-        response = ollama.chat(
-            model=MODEL_NAME,
-            messages=[
+        response = call_model(
+            [
                 {'role': 'system', 'content': system_prompt},
                 {'role': 'user', 'content': message}
-            ]
+            ],
+            deadline,
+            options={'num_predict': 400},
         )
         return {
             "session_id": session_id,
@@ -0,0 +1,60 @@
+"""
+Temps passé par étape (llm, amadeus, sheets...) pendant un tour /chat.
+
+main.py ouvre un collecteur par requête ; les appels externes sont entourés
+de `with stage("...")`. Hors collecteur, stage() ne fait rien (aucun coût).
+Les étapes lancées en parallèle (étapes multi-destinations, lots d'hôtels)
+s'additionnent : c'est un temps cumulé, pas un temps mur.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Dict, Iterator, Optional
+
+from mcp import profiling
+
+_current: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+_lock = threading.Lock()
+
+
+@contextmanager
+def collect(timings: Optional[Dict[str, float]] = None) -> Iterator[Dict[str, float]]:
+    """Active un collecteur (nouveau dict, ou un dict existant pour reprendre un tour en streaming)."""
+    timings = {} if timings is None else timings
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def submit(pool, fn, *args, **kwargs):
+    """pool.submit en propageant le collecteur courant (et le tour profilé) au thread du pool."""
+    return pool.submit(copy_context().run, profiling.follow, fn, *args, **kwargs)
+
+
+def server_timing_header(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """Valeur d'en-tête Server-Timing (durées en ms), lisible par le navigateur et le load-test."""
+    parts = [f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in sorted(timings.items())]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
@@ -0,0 +1,224 @@
+"""
+Préchauffage du cache de recherche (vols / hôtels).
+
+Un thread de fond, démarré par le lifespan FastAPI, rafraîchit avant expiration :
+- les requêtes configurées (mcp/data/warm_queries.json ou WARM_QUERIES_PATH)
+- les requêtes utilisateur les plus fréquentes (compteurs de mcp/cache.py)
+
+Contraintes :
+- opt-in (CACHE_WARMING=1) et jamais sans identifiants Amadeus
+- budget d'appels Amadeus par heure (WARM_MAX_CALLS_PER_HOUR), les appels
+  réellement faits par le warmer (token, ville, liste, offres, hedging) sont décomptés
+- priorité basse : thread "nice" et pause tant qu'une recherche utilisateur est en cours
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+from mcp import cache, provider
+from mcp.provider import api_call_count, calls_from, fetch_flights, fetch_hotels, is_complete, user_searches_in_flight
+
+WARM_ENABLED = os.getenv("CACHE_WARMING", "0") == "1"
+WARM_QUERIES_PATH = os.getenv(
+    "WARM_QUERIES_PATH", os.path.join(os.path.dirname(__file__), "data", "warm_queries.json")
+)
+WARM_INTERVAL_S = float(os.getenv("WARM_INTERVAL_S", "60"))
+# On rafraîchit une entrée quand il lui reste moins que cette marge
+WARM_MARGIN_S = float(os.getenv("WARM_MARGIN_S", "180"))
+WARM_MAX_CALLS_PER_HOUR = int(os.getenv("WARM_MAX_CALLS_PER_HOUR", "30"))
+WARM_LEARNED_TOP_N = int(os.getenv("WARM_LEARNED_TOP_N", "5"))
+
+# Coût estimé d'un rafraîchissement (token compris) pour savoir s'il reste assez de budget
+_ESTIMATED_CALLS = {"flights": 2, "hotels": 6}
+
+_FETCHERS = {"flights": fetch_flights, "hotels": fetch_hotels}
+
+_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+_stats = {"runs": 0, "refreshed": 0, "failed": 0, "skipped_quota": 0, "skipped_busy": 0, "api_calls": 0}
+_calls_window: List[Tuple[float, int]] = []  # (timestamp, nb d'appels) sur la dernière heure
+_calls_lock = threading.Lock()  # protège aussi _stats
+
+
+# ---------------------------
+# REQUÊTES À PRÉCHAUFFER
+# ---------------------------
+
+def _upcoming_weekends(n: int, today: Optional[date] = None) -> List[Tuple[str, str]]:
+    """(vendredi, dimanche) des n prochains week-ends."""
+    today = today or date.today()
+    friday = today + timedelta(days=(4 - today.weekday()) % 7 or 7)
+    return [
+        ((friday + timedelta(weeks=i)).isoformat(), (friday + timedelta(weeks=i, days=2)).isoformat())
+        for i in range(n)
+    ]
+
+
+def _expand(kind: str, query: dict) -> List[dict]:
+    """
+    Remplace les dates relatives "weekends:N" par les N prochains week-ends :
+    - vols : departureDate = chaque vendredi
+    - hôtels : checkin = vendredi, checkout = dimanche
+    """
+    field = "departureDate" if kind == "flights" else "checkin"
+    value = str(query.get(field) or "")
+    if not value.startswith("weekends:"):
+        return [query]
+
+    expanded = []
+    for friday, sunday in _upcoming_weekends(int(value.split(":", 1)[1])):
+        q = dict(query)
+        if kind == "flights":
+            q["departureDate"] = friday
+        else:
+            q["checkin"], q["checkout"] = friday, sunday
+        expanded.append(q)
+    return expanded
+
+
+def _configured_queries() -> List[Tuple[str, dict]]:
+    try:
+        with open(WARM_QUERIES_PATH, encoding="utf-8") as f:
+            items = json.load(f)
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        print(f"Erreur lecture {WARM_QUERIES_PATH} : {e}")
+        return []
+
+    queries = []
+    for item in items:
+        kind = item.get("kind")
+        if kind in _FETCHERS and isinstance(item.get("query"), dict):
+            queries.extend((kind, q) for q in _expand(kind, item["query"]))
+    return queries
+
+
+def warm_targets() -> List[Tuple[str, dict]]:
+    """Requêtes configurées + apprises, sans doublons ni dates passées."""
+    seen = set()
+    targets = []
+    for kind, query in _configured_queries() + cache.hot_queries(WARM_LEARNED_TOP_N):
+        key = cache.make_key(kind, query)
+        if key in seen or cache.is_past(kind, query):
+            continue
+        seen.add(key)
+        targets.append((kind, query))
+    return targets
+
+
+# ---------------------------
+# BUDGET / PRIORITÉ
+# ---------------------------
+
+def _calls_last_hour() -> int:
+    cutoff = time.time() - 3600
+    with _calls_lock:
+        while _calls_window and _calls_window[0][0] < cutoff:
+            _calls_window.pop(0)
+        return sum(n for _, n in _calls_window)
+
+
+def _lower_thread_priority() -> None:
+    # Sous Linux, la priorité (nice) est par thread : on ne ralentit pas les requêtes /chat
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+
+# ---------------------------
+# BOUCLE
+# ---------------------------
+
+def _count(stat: str, n: int = 1) -> None:
+    with _calls_lock:
+        _stats[stat] += n
+
+
+def refresh(kind: str, query: dict) -> bool:
+    """
+    Rafraîchit une requête dans le cache. Seuls les appels Amadeus du warmer sont
+    décomptés du budget (pas ceux des utilisateurs faits au même moment).
+    """
+    before = api_call_count("warm")
+    try:
+        with calls_from("warm"):
+            data = _FETCHERS[kind](query)
+        if is_complete(kind, data):
+            cache.put(kind, query, data, source="warm")
+        _count("refreshed")
+        return True
+    except Exception as e:
+        print(f"Erreur préchauffage {kind} {query} : {e}")
+        _count("failed")
+        return False
+    finally:
+        calls = api_call_count("warm") - before
+        with _calls_lock:
+            _calls_window.append((time.time(), calls))
+            _stats["api_calls"] += calls
+
+
+def run_once() -> None:
+    _count("runs")
+    for kind, query in warm_targets():
+        if _stop.is_set():
+            return
+        if cache.ttl_left(kind, query) > WARM_MARGIN_S:
+            continue
+        if _calls_last_hour() + _ESTIMATED_CALLS[kind] > WARM_MAX_CALLS_PER_HOUR:
+            _count("skipped_quota")
+            continue
+        if user_searches_in_flight() > 0:
+            # Les utilisateurs passent en premier, on reprendra au prochain tour
+            _count("skipped_busy")
+            return
+        refresh(kind, query)
+
+
+def _loop() -> None:
+    _lower_thread_priority()
+    while not _stop.is_set():
+        try:
+            run_once()
+        except Exception as e:
+            print(f"Erreur warmer : {e}")
+        _stop.wait(WARM_INTERVAL_S)
+
+
+def start() -> None:
+    global _thread
+    if not WARM_ENABLED or (_thread is not None and _thread.is_alive()):
+        return
+    if not provider.CLIENT_ID or not provider.CLIENT_SECRET:
+        print("Préchauffage désactivé : AMADEUS_CLIENT_ID / AMADEUS_CLIENT_SECRET manquants")
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="cache-warmer", daemon=True)
+    _thread.start()
+
+
+def stop() -> None:
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=5)
+
+
+def stats() -> dict:
+    with _calls_lock:
+        counters = dict(_stats)
+    return {
+        **counters,
+        "enabled": WARM_ENABLED,
+        "running": _thread is not None and _thread.is_alive(),
+        "calls_last_hour": _calls_last_hour(),
+        "max_calls_per_hour": WARM_MAX_CALLS_PER_HOUR,
+        "targets": len(warm_targets()),
+    }
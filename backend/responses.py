@@ -0,0 +1,66 @@
+"""
+Chemin de réponse rapide de l'API :
+- FastJSONResponse : orjson si installé (sinon json compact), sans jsonable_encoder
+- compression gzip (ou br si brotli-asgi est installé) au-dessus d'un seuil
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Iterable
+
+from fastapi.responses import JSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+
+try:
+    import orjson
+except ImportError:  # dépendance optionnelle
+    orjson = None
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # dépendance optionnelle
+    BrotliMiddleware = None
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Réponse JSON pour des données internes de confiance : pas de jsonable_encoder,
+    pas de validation (FastAPI ne re-valide pas une Response renvoyée telle quelle).
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+# ---------------------------
+# COMPRESSION
+# ---------------------------
+
+class CompressionMiddleware:
+    """
+    gzip (ou br si brotli-asgi est installé) au-dessus de minimum_size octets.
+    Les chemins de streaming sont exclus : le compresseur retiendrait les petits
+    événements et casserait l'affichage progressif.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, skip_paths: Iterable[str] = ()):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+        if BrotliMiddleware is not None:
+            self.compressed = BrotliMiddleware(app, minimum_size=minimum_size, gzip_fallback=True)
+        else:
+            self.compressed = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in self.skip_paths:
+            await self.app(scope, receive, send)
+        else:
+            await self.compressed(scope, receive, send)